@@ -0,0 +1,169 @@
+"""
+Benchmark Client.get and Client.query against the local stand-in server.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --fields 49 500 --rows 100 3000 --workers 1 8 \\
+        --latency 0.05 --json baseline.json
+
+The stand-in server runs in a child process, unless --server points at
+one that is already running. Each scenario is run --repeat times after
+one warm-up call. For each one the report gives the mean throughput in
+rows and requests per second, the 50th, 95th and 99th percentile latency
+of a call, and the peak memory traced during one extra call.
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from census import Census  # noqa: E402
+
+from server import StandInSession, variable_names  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@contextmanager
+def stand_in_server(variables):
+    """
+    Start the stand-in server in a child process and yield its URL.
+    """
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'server.py'), '--port', '0',
+         '--variables', str(variables)],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def running_server(url):
+    yield url
+
+
+def run_scenario(url, method, fields, rows, workers, latency, repeat, output):
+    session = StandInSession(url, rows=rows, latency=latency)
+    census = Census('benchmark', session=session, max_workers=workers)
+    names = variable_names(fields)
+    geo = {'for': 'county:*', 'in': 'state:06'}
+
+    if method == 'query':
+        names = names[:49]
+
+    def call():
+        return getattr(census.acs5, method)(names, geo, year=2022, output=output)
+
+    call()
+
+    latencies = []
+    requests_before = session.requests
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    requests_made = session.requests - requests_before
+
+    tracemalloc.start()
+    result = call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    elapsed = sum(latencies)
+    return {
+        'method': method,
+        'fields': len(names),
+        'rows': rows,
+        'workers': workers,
+        'output': output,
+        'latency': latency,
+        'rows_per_s': rows * repeat / elapsed,
+        'requests_per_s': requests_made / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_mb': peak / 1024.0 / 1024.0,
+    }
+
+
+COLUMNS = (
+    ('method', 6, ''), ('fields', 6, ''), ('rows', 6, ''), ('workers', 7, ''),
+    ('output', 8, ''), ('rows_per_s', 11, '.0f'), ('requests_per_s', 14, '.1f'),
+    ('p50_ms', 8, '.1f'), ('p95_ms', 8, '.1f'), ('p99_ms', 8, '.1f'),
+    ('peak_mb', 8, '.1f'),
+)
+
+
+def print_header(out=sys.stdout):
+    out.write('  '.join('{:>{}}'.format(name, width) for name, width, _ in COLUMNS) + '\n')
+
+
+def print_row(result, out=sys.stdout):
+    out.write('  '.join('{:>{}{}}'.format(result[name], width, spec)
+                        for name, width, spec in COLUMNS) + '\n')
+    out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--methods', nargs='+', default=['get', 'query'], choices=['get', 'query'])
+    parser.add_argument('--fields', nargs='+', type=int, default=[49, 500])
+    parser.add_argument('--rows', nargs='+', type=int, default=[100, 3000])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--outputs', nargs='+', default=['dicts'])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the server waits before each response')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--server', help='URL of a stand-in server that is already running')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.server:
+        server = running_server(args.server)
+    else:
+        server = stand_in_server(max(args.fields))
+
+    with server as url:
+        print_header()
+        scenarios = itertools.product(args.methods, args.fields, args.rows,
+                                      args.workers, args.outputs)
+        seen = set()
+        for method, fields, rows, workers, output in scenarios:
+            # query sends one request of at most 49 fields, so the field
+            # count and worker count don't change it.
+            key = (method, min(fields, 49) if method == 'query' else fields, rows,
+                   1 if method == 'query' else workers, output)
+            if key in seen:
+                continue
+            seen.add(key)
+            result = run_scenario(url, method, fields, rows, workers, args.latency,
+                                  args.repeat, output)
+            print_row(result)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+A local stand-in for api.census.gov, for benchmarking without a key or
+network access.
+
+It serves synthetic variables.json, groups.json, per-group and
+per-variable metadata and data responses, including group() requests,
+for any dataset and year. Data requests for a
+wildcard geography return `rows` rows; every request waits `latency`
+seconds before it is answered. A client can override both for its own
+requests with the X-Stand-In-Rows and X-Stand-In-Latency headers.
+
+Run it on its own, so that it does not compete with the client being
+measured for the interpreter, with:
+
+    python benchmarks/server.py --port 8000
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+CENSUS_HOST = 'https://api.census.gov'
+
+
+def variable_names(count):
+    """
+    Names for count estimate variables, in the ACS style.
+    """
+    return ['B{:05d}_{:03d}E'.format(i // 999 + 1, i % 999 + 1) for i in range(count)]
+
+
+class StandInCensus(object):
+    """
+    Run the stand-in server on a free local port until close() is called
+    (or the with block exits).
+    """
+
+    def __init__(self, rows=3000, variables=1000, latency=0.0, host='127.0.0.1', port=0):
+        self.rows = rows
+        self.variables = variable_names(variables)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._payloads = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def session(self, **kwargs):
+        """
+        A requests session whose api.census.gov requests go to this server.
+        """
+        return StandInSession(self.url, **kwargs)
+
+    def serve_forever(self):
+        self._thread.join()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.requests += 1
+                rows = int(self.headers.get('X-Stand-In-Rows') or stand_in.rows)
+                latency = float(self.headers.get('X-Stand-In-Latency') or stand_in.latency)
+                if latency:
+                    time.sleep(latency)
+
+                status, payload = stand_in.payload(self.path, rows)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json;charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def payload(self, path, rows):
+        """
+        The status and encoded body for a request, rendered once per path
+        and row count so that the server spends little time per request.
+        """
+        key = (path, rows)
+        with self._lock:
+            cached = self._payloads.get(key)
+        if cached is None:
+            url = urlsplit(path)
+            status, body = self.respond(url.path, parse_qs(url.query), rows)
+            cached = status, json.dumps(body).encode('utf-8')
+            with self._lock:
+                if len(self._payloads) > 1024:
+                    self._payloads.clear()
+                self._payloads[key] = cached
+        return cached
+
+    def respond(self, path, params, rows=None):
+        if path.endswith('/variables.json'):
+            variables = {name: {'label': name, 'concept': 'SYNTHETIC', 'predicateType': 'int'}
+                         for name in self.variables}
+            variables['NAME'] = {'label': 'Geographic Area Name', 'predicateType': 'string'}
+            variables['GEO_ID'] = {'label': 'Geography', 'predicateType': 'string'}
+            return 200, {'variables': variables}
+
+        if path.endswith('/groups.json'):
+            groups = sorted({name.split('_')[0] for name in self.variables})
+            return 200, {'groups': [{'name': group, 'description': 'SYNTHETIC'} for group in groups]}
+
+        match = re.search(r'/groups/([^/]+)\.json$', path)
+        if match:
+            variables = {name: {'label': name, 'predicateType': 'int'}
+                         for name in self.group(match.group(1))}
+            return 200, {'variables': variables}
+
+        match = re.search(r'/variables/([^/]+)\.json$', path)
+        if match:
+            return 200, {'name': match.group(1), 'label': match.group(1), 'predicateType': 'int'}
+
+        if 'get' not in params or 'for' not in params:
+            return 400, 'error: missing get or for'
+
+        fields = []
+        for field in params['get'][0].split(','):
+            group = re.match(r'group\((.+)\)$', field)
+            fields += ['GEO_ID', 'NAME'] + self.group(group.group(1)) if group else [field]
+        level, code = params['for'][0].split(':')
+        parents = re.findall(r'(.+?):(\S+)\s*', params.get('in', [''])[0])
+        parent_codes = ''.join(parent_code for _, parent_code in parents)
+        codes = (['{:06d}'.format(i) for i in range(self.rows if rows is None else rows)]
+                 if code == '*' else code.split(','))
+
+        rows = [fields + [parent for parent, _ in parents] + [level]]
+        for code in codes:
+            geoid = parent_codes + code
+            rows.append([self.value(field, geoid) for field in fields]
+                        + [parent_code for _, parent_code in parents] + [code])
+        return 200, rows
+
+    def group(self, name):
+        return [variable for variable in self.variables if variable.split('_')[0] == name]
+
+    @staticmethod
+    def value(field, geoid):
+        if field == 'GEO_ID':
+            return '0500000US' + geoid
+        if field == 'NAME':
+            return 'Place {}'.format(geoid)
+        return str((int(geoid) * 7919 + len(field)) % 100000)
+
+
+class StandInSession(requests.Session):
+    """
+    Sends requests for api.census.gov to base_url instead.
+    """
+
+    def __init__(self, base_url, rows=None, latency=None, pool_size=64):
+        super(StandInSession, self).__init__()
+        self.base_url = base_url.rstrip('/')
+        self.requests = 0
+        self._lock = threading.Lock()
+        if rows is not None:
+            self.headers['X-Stand-In-Rows'] = str(rows)
+        if latency is not None:
+            self.headers['X-Stand-In-Latency'] = str(latency)
+        self.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+
+    def request(self, method, url, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+        if url.startswith(CENSUS_HOST):
+            url = self.base_url + url[len(CENSUS_HOST):]
+        return super(StandInSession, self).request(method, url, *args, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a stand-in Census API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--variables', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    server = StandInCensus(rows=args.rows, variables=args.variables, latency=args.latency,
+                           host=args.host, port=args.port)
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
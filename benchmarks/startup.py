@@ -0,0 +1,56 @@
+"""
+Measure cold-start costs in fresh interpreters: importing census,
+constructing Census, and the first use of one dataset client.
+
+    python benchmarks/startup.py --runs 20
+
+Each run is a new process, so nothing is shared between them. The
+report gives the median and worst time of each step in milliseconds.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import census
+imported = time.perf_counter()
+c = census.Census('benchmark')
+constructed = time.perf_counter()
+c.acs5
+first_client = time.perf_counter()
+print(json.dumps({
+    'import census': imported - start,
+    'Census()': constructed - imported,
+    'first client': first_client - constructed,
+}))
+'''
+
+
+def run_once():
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=ROOT,
+                                      universal_newlines=True)
+    return json.loads(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+
+    print('{:>14}  {:>10}  {:>10}'.format('step', 'median_ms', 'max_ms'))
+    for step in runs[0]:
+        times = [run[step] * 1000 for run in runs]
+        print('{:>14}  {:>10.2f}  {:>10.2f}'.format(step, statistics.median(times), max(times)))
+
+
+if __name__ == '__main__':
+    main()
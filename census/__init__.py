@@ -1,2 +1,3 @@
 from census.core import (Census, ALL, CensusException,
+                         ThrottledException, UnmatchedRowsWarning,
                          UnsupportedYearException)
@@ -0,0 +1,77 @@
+"""
+Command line interface.
+
+    python -m census export acs5 counties.csv --year 2022 --fields NAME,B01001_001E
+        --for 'county:*' --in 'state:*'
+
+    python -m census export acs5 tracts.parquet --table B01001
+        --for 'tract:*' --in 'state:24 county:*'
+
+The API key is read from --key or the CENSUS_KEY environment variable.
+"""
+import argparse
+import os
+import sys
+
+from census.core import Census
+from census.export import FORMATS, export
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m census')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_export = commands.add_parser(
+        'export', help='stream query results to a CSV, NDJSON or Parquet file')
+    parser_export.add_argument('dataset', choices=sorted(
+        name for name in Census.DATASETS if not name.startswith('_')))
+    parser_export.add_argument('output', help="path to write, or '-' for standard output")
+    what = parser_export.add_mutually_exclusive_group(required=True)
+    what.add_argument('--fields', help='comma-separated variables')
+    what.add_argument('--table', help='a table (group) such as B01001')
+    parser_export.add_argument('--for', dest='for_clause', required=True,
+                               help="the geography to return, e.g. 'county:*'")
+    parser_export.add_argument('--in', dest='in_clause',
+                               help="parent geographies, e.g. 'state:24', or 'state:*'")
+    parser_export.add_argument('--year', type=int)
+    parser_export.add_argument('--format', choices=FORMATS,
+                               help="by default, taken from output's extension")
+    parser_export.add_argument('--batch-size', type=int, default=5000)
+    parser_export.add_argument('--workers', type=int, default=8,
+                               help='requests in flight at a time')
+    parser_export.add_argument('--key', default=os.environ.get('CENSUS_KEY'))
+    archive = parser_export.add_mutually_exclusive_group()
+    archive.add_argument('--record', metavar='ARCHIVE',
+                         help='also write every response to this archive')
+    archive.add_argument('--replay', metavar='ARCHIVE',
+                         help='answer requests from this archive instead of the API')
+
+    args = parser.parse_args(argv)
+    if not args.key:
+        parser.error('pass --key or set CENSUS_KEY')
+
+    geo = {'for': args.for_clause}
+    if args.in_clause:
+        geo['in'] = args.in_clause
+
+    session = None
+    if args.record:
+        from census.archive import RecordingTransport
+        session = RecordingTransport(args.record)
+    elif args.replay:
+        from census.archive import ReplayTransport
+        session = ReplayTransport(args.replay)
+
+    with Census(args.key, session=session, max_workers=args.workers) as c:
+        count = export(getattr(c, args.dataset), args.output, geo,
+                       fields=args.fields.split(',') if args.fields else None,
+                       table=args.table, year=args.year, format=args.format,
+                       batch_size=args.batch_size, max_workers=args.workers)
+
+    if args.output != '-':
+        sys.stderr.write('Wrote {} rows to {}\n'.format(count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,595 @@
+"""
+asyncio versions of the Census clients.
+
+The dataset clients here inherit every geography helper from their
+blocking counterparts in census.core; on these clients the helpers return
+awaitables. Requests go through one pooled httpx.AsyncClient, and the
+number of requests in flight across all clients of an AsyncCensus is
+bounded by max_concurrency.
+"""
+import asyncio
+import codecs
+import time
+from operator import itemgetter
+
+from census.core import (
+    ALL, ACS1Client, ACS1DpClient, ACS3Client, ACS3DpClient, ACS5Client,
+    ACS5DpClient, ACS5StClient, APIKeyError, CensusException, Client,
+    FieldTypes, JSONArrayParser, OUTPUTS, PLClient, RetryPolicy, SF1Client,
+    StreamJoin, chunks, compile_decoder, concat_results, geo_clauses, geo_key,
+    join_tables, list_of_years, list_or_str, package_version, prefetch_work,
+    supported_years, tag_result)
+from census.flight import AsyncSingleFlight
+from census.hooks import Hooks, lap
+from census.throttle import AsyncRateLimiter
+
+
+def new_async_session(max_connections=20, http2=False, timeout=None):
+    import httpx
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(max_connections=max_connections,
+                            max_keepalive_connections=max_connections),
+        timeout=timeout,
+    )
+
+
+async def gather_all(aws):
+    """
+    Run the awaitables concurrently and return their results in order.
+    If one of them raises, the others are cancelled and the error is
+    re-raised.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+class ConcurrencyLimit(object):
+    """
+    A semaphore shared by several clients. It is created on first use
+    so that it belongs to the running event loop.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+
+class AsyncClient(Client):
+
+    def __init__(self, key, year=None, session=None, retries=3,
+                 max_concurrency=20, field_types=None, metadata_cache=None,
+                 response_cache=None, limit=None, rate_limiter=None, retry_policy=None,
+                 null_values=None, hooks=None, single_flight=None):
+        super(AsyncClient, self).__init__(
+            key, year, session=session or new_async_session(max_concurrency),
+            retries=retries, max_workers=None, field_types=field_types,
+            metadata_cache=metadata_cache, response_cache=response_cache,
+            rate_limiter=rate_limiter, retry_policy=retry_policy,
+            null_values=null_values, hooks=hooks, single_flight=single_flight)
+        self.limit = limit or ConcurrencyLimit(max_concurrency)
+        self._type_locks = {}
+
+    async def _request(self, url, params, headers=None):
+        return await self._send(lambda: self.session.get(url, params=params, headers=headers))
+
+    async def _send(self, send):
+        """
+        Await send(), within the concurrency limit and, when there is one,
+        the rate limiter's budget.
+        """
+        async with self.limit.semaphore:
+            if self.rate_limiter is None:
+                return await send()
+
+            await self.rate_limiter.acquire()
+            status_code = None
+            try:
+                resp = await send()
+                status_code = resp.status_code
+                return resp
+            finally:
+                await self.rate_limiter.release(status_code)
+
+    async def _metadata(self, url, year, document):
+        async def fetch(headers=None):
+            resp = await self._request(url, {"key": self._key}, headers=headers)
+            if resp.status_code not in (200, 304):
+                raise CensusException(resp.text, response=resp)
+            return resp
+
+        if self.metadata_cache is None:
+            return (await fetch()).json()
+        return await self.metadata_cache.aget((self.dataset, int(year), document), fetch)
+
+    async def tables(self, year=None):
+        """
+        Returns a list of the data tables available from this source.
+        """
+        if year is None:
+            year = self.default_year
+
+        tables_url = self._endpoints(year).groups_url % (year, self.dataset)
+        return (await self._metadata(tables_url, year, 'groups'))['groups']
+
+    async def _variables(self, year):
+        fields_url = self._endpoints(year).definitions_url % (year, self.dataset)
+        return (await self._metadata(fields_url, year, 'variables'))['variables']
+
+    @supported_years()
+    async def fields(self, year=None, flat=False):
+        if year is None:
+            year = self.default_year
+
+        return self._fields(await self._variables(year), flat)
+
+    async def get(self, fields, geo, year=None, output='dicts', **kwargs):
+        """
+        The API only accepts up to 50 fields on each query. The chunks are
+        requested concurrently and joined exactly as Client.get does.
+        """
+        field_chunks = list(chunks(list_or_str(fields), 49))
+        if len(field_chunks) <= 1:
+            return await self.query(fields, geo, year, output=output, **kwargs)
+
+        if output not in OUTPUTS:
+            raise ValueError('output must be one of {}'.format(', '.join(OUTPUTS)))
+        if year is None:
+            year = self.default_year
+
+        if int(year) > 2009:
+            field_chunks = [list(chunk) + ['GEO_ID'] for chunk in field_chunks]
+
+        async def fetch(forty_nine_fields):
+            with self.hooks.instrument('chunk', self.dataset, year, geo, forty_nine_fields) as event:
+                return await self._fetch(forty_nine_fields, geo, year, event=event, **kwargs)
+
+        with self.hooks.instrument('get', self.dataset, year, geo, fields) as event:
+            start = time.perf_counter()
+            tables = await gather_all(fetch(forty_nine_fields) for forty_nine_fields in field_chunks)
+            start = lap(event, 'fetch', start)
+            headers, data = join_tables(tables, field_chunks)
+            start = lap(event, 'join', start)
+
+            types = await self._header_types(headers, year)
+            start = lap(event, 'types', start)
+            result = self._decode(headers, types, data, output)
+            lap(event, 'cast', start)
+            if event is not None:
+                event.rows = len(data)
+            return result
+
+    async def fan_out(self, fields, geo, year=None, **kwargs):
+        """
+        Like get, but any level of geo['in'] may be Census.ALL. See
+        Client.fan_out.
+        """
+        if year is None:
+            year = self.default_year
+
+        children = await self._fan_out_geos(geo, year)
+        results = await gather_all(self.get(fields, child, year=year, **kwargs)
+                                   for child in children)
+
+        return concat_results(results, kwargs.get('output', 'dicts'))
+
+    async def iter_fan_out(self, fields, geo, year=None, **kwargs):
+        """
+        Like fan_out, but yields the result of each parent geography's get
+        as soon as it arrives, in no particular order. See
+        Client.iter_fan_out.
+        """
+        if year is None:
+            year = self.default_year
+
+        children = await self._fan_out_geos(geo, year)
+        tasks = [asyncio.ensure_future(self.get(fields, child, year=year, **kwargs))
+                 for child in children]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fan_out_geos(self, geo, year):
+        """
+        Expand the wildcards in geo['in'] into one geography per parent.
+        See Client._fan_out_geos.
+        """
+        parents = [[]]
+        for level, code in geo_clauses(geo.get('in')):
+            if code != ALL:
+                parents = [parent + [(level, code)] for parent in parents]
+                continue
+
+            async def children(parent, level=level):
+                rows = await self.query(['NAME'], self._geo(level + ':' + ALL, parent), year)
+                return [parent + [(level, row[level])] for row in rows]
+
+            parents = [child
+                       for found in await gather_all(children(parent) for parent in parents)
+                       for child in sorted(found)]
+
+        return [self._geo(geo['for'], parent) for parent in parents]
+
+    async def batch(self, fields, geos, year=None, max_url_length=None, **kwargs):
+        """
+        Look up fields for many single geographies in as few requests as
+        possible. See Client.batch.
+        """
+        if year is None:
+            year = self.default_year
+
+        requests = self._batch_requests(fields, geos, year, max_url_length, kwargs)
+        results = await gather_all(self.get(fields, geo, year, **kwargs) for geo in requests)
+
+        return self._batch_rows(geos, requests, results)
+
+    async def panel(self, fields, geo, years, **kwargs):
+        """
+        Like get, for each of years at once. See Client.panel.
+        """
+        years = self._panel_years(years)
+        output = kwargs.get('output', 'dicts')
+
+        results = await gather_all(self.get(fields, geo, year=year, **kwargs) for year in years)
+
+        return concat_results((tag_result(result, 'year', year, output)
+                               for result, year in zip(results, years)), output)
+
+    async def iter_get(self, fields, geo, year=None, **kwargs):
+        """
+        Like get, but an async generator of one dict per row, yielded
+        while the last chunk's response is still streaming in. See
+        Client.iter_get.
+        """
+        field_chunks = list(chunks(list_or_str(fields), 49))
+
+        async def index(forty_nine_fields):
+            return {geo_key(row, forty_nine_fields): row
+                    async for row in self.iter_query(forty_nine_fields, geo, year, **kwargs)}
+
+        indexes = await gather_all(index(forty_nine_fields)
+                                   for forty_nine_fields in field_chunks[:-1])
+        joiner = StreamJoin(field_chunks, indexes)
+        async for row in self.iter_query(field_chunks[-1], geo, year, **kwargs):
+            yield joiner.join(row)
+        for row in joiner.leftovers():
+            yield row
+
+    async def iter_query(self, fields, geo, year=None, chunk_size=64 * 1024, **kwargs):
+        """
+        Like query, but an async generator that parses the response
+        incrementally and yields one dict per row as it arrives. See
+        Client.iter_query.
+        """
+        if year is None:
+            year = self.default_year
+
+        fields, url, params = self._query_params(fields, geo, year)
+        resp = await self._open_stream(url, params)
+        if resp is None:
+            return
+
+        try:
+            text = codecs.getincrementaldecoder(resp.encoding or 'utf-8')(errors='replace')
+            parser = JSONArrayParser()
+            decoder = None
+            body = resp.aiter_bytes(chunk_size)
+            async for chunk in body:
+                try:
+                    rows = parser.feed(text.decode(chunk))
+                except ValueError as ex:
+                    rest = ''.join([text.decode(more) async for more in body])
+                    message = str(ex) + rest + text.decode(b'', final=True)
+                    if '<title>Invalid Key</title>' in message:
+                        raise APIKeyError(' '.join(message.splitlines()))
+                    raise ValueError(message)
+
+                for row in rows:
+                    if decoder is None:
+                        types = await self._header_types(row, year)
+                        decoder = compile_decoder(tuple(row), tuple(types), self.null_values)
+                    else:
+                        yield decoder.row(row)
+                if parser.done:
+                    return
+            parser.close()
+        finally:
+            await resp.aclose()
+
+    async def _open_stream(self, url, params):
+        attempt = 1
+        while True:
+            try:
+                return await self._open_stream_once(url, params)
+            except Exception as e:
+                delay = self.retry_policy.retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _open_stream_once(self, url, params):
+        request = self.session.build_request('GET', url, params=params)
+        resp = await self._send(lambda: self.session.send(request, stream=True))
+        if resp.status_code == 200:
+            return resp
+        try:
+            await resp.aread()
+            self._response_data(resp)
+        finally:
+            await resp.aclose()
+
+    async def query(self, fields, geo, year=None, sort_by_geoid=False, cache=True,
+                    output='dicts', **kwargs):
+        if output not in OUTPUTS:
+            raise ValueError('output must be one of {}'.format(', '.join(OUTPUTS)))
+        if year is None:
+            year = self.default_year
+
+        fields = list_or_str(fields)
+        if sort_by_geoid:
+            fields = list(fields) + ['GEO_ID']
+
+        with self.hooks.instrument('query', self.dataset, year, geo, fields) as event:
+            headers, data = await self._fetch(fields, geo, year, cache, event=event)
+            start = time.perf_counter()
+            if sort_by_geoid:
+                data.sort(key=itemgetter(headers.index('GEO_ID')))
+                start = lap(event, 'sort', start)
+
+            types = await self._header_types(headers, year)
+            start = lap(event, 'types', start)
+            result = self._decode(headers, types, data, output)
+            lap(event, 'cast', start)
+            return result
+
+    @supported_years()
+    async def get_table(self, table, geo, year=None, cache=True, output='dicts', **kwargs):
+        """
+        Request every variable of table in a single request. See
+        Client.get_table.
+        """
+        if output not in OUTPUTS:
+            raise ValueError('output must be one of {}'.format(', '.join(OUTPUTS)))
+        if year is None:
+            year = self.default_year
+
+        fields = ['group({})'.format(table)]
+        with self.hooks.instrument('table', self.dataset, year, geo, fields) as event:
+            headers, data = await self._fetch(fields, geo, year, cache, event=event)
+            start = time.perf_counter()
+            type_map = await self._table_types(table, year)
+            types = [type_map.get(header, str) for header in headers]
+            start = lap(event, 'types', start)
+            result = self._decode(headers, types, data, output)
+            lap(event, 'cast', start)
+            return result
+
+    async def _fetch(self, fields, geo, year, cache=True, event=None, **kwargs):
+        if self.single_flight is None:
+            return await self._fetch_upstream(fields, geo, year, cache, event)
+
+        (headers, data), shared = await self.single_flight.do(
+            self._flight_key(fields, geo, year, cache),
+            lambda: self._fetch_upstream(fields, geo, year, cache, event))
+        if event is not None:
+            event.coalesced = shared
+        return headers, list(data)
+
+    async def _fetch_upstream(self, fields, geo, year, cache, event):
+        attempt = 1
+        while True:
+            try:
+                return await self._fetch_once(fields, geo, year, cache, event)
+            except Exception as e:
+                delay = self.retry_policy.retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _fetch_once(self, fields, geo, year, cache, event):
+        fields, url, params = self._query_params(fields, geo, year)
+
+        cache_key = self._cache_key(url, fields, geo, cache)
+        data = self._cached_data(cache_key, cache)
+        if event is not None:
+            event.attempts += 1
+            event.url = url
+            if cache_key is not None:
+                event.cache = 'miss' if data is None else 'hit'
+
+        if data is None:
+            start = time.perf_counter()
+            resp = await self._request(url, params)
+            start = lap(event, 'network', start)
+            if event is not None:
+                event.status = resp.status_code
+                event.bytes += len(resp.content)
+            data = self._response_data(resp, cache_key)
+            lap(event, 'json', start)
+            if data is None:
+                return [], []
+
+        if event is not None:
+            event.rows = len(data) - 1
+        return data[0], data[1:]
+
+    async def _header_types(self, headers, year):
+        try:
+            type_map = await self._load_types(year)
+        except CensusException:
+            type_map = {}
+        return [type_map.get(header, str) for header in headers]
+
+    async def _field_type(self, field, year):
+        return (await self._header_types([field], year))[0]
+
+    async def _load_types(self, year):
+        return await self._load_type_map(self.dataset, year, lambda: self._variables(year))
+
+    async def _table_types(self, table, year):
+        types = self.field_types.peek(self.dataset, year)
+        if types is not None:
+            return types
+
+        async def load():
+            url = self._endpoints(year).group_url % (year, self.dataset, table)
+            return (await self._metadata(url, year, 'group-' + table))['variables']
+
+        try:
+            return await self._load_type_map(self._table_key(table), year, load)
+        except CensusException:
+            return {}
+
+    async def _load_type_map(self, name, year, load):
+        types = self.field_types.peek(name, year)
+        if types is not None:
+            return types
+
+        key = (name, int(year))
+        lock = self._type_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            types = self.field_types.peek(name, year)
+            if types is None:
+                self.field_types.raise_recent_failure(name, year)
+                try:
+                    types = self.field_types.store(name, year, await load())
+                except Exception as e:
+                    self.field_types.fail(name, year, e)
+                    raise
+        return types
+
+    async def prefetch(self, years=None):
+        """
+        Load the field types for each of years (by default, the default
+        year) concurrently.
+        """
+        years = list_of_years(years if years is not None else self.default_year)
+        await gather_all(self._load_types(year) for year in years)
+
+
+class AsyncACS5Client(ACS5Client, AsyncClient):
+    pass
+
+
+class AsyncACS5DpClient(ACS5DpClient, AsyncClient):
+    pass
+
+
+class AsyncACS5StClient(ACS5StClient, AsyncClient):
+    pass
+
+
+class AsyncACS3Client(ACS3Client, AsyncClient):
+    pass
+
+
+class AsyncACS3DpClient(ACS3DpClient, AsyncClient):
+    pass
+
+
+class AsyncACS1Client(ACS1Client, AsyncClient):
+    pass
+
+
+class AsyncACS1DpClient(ACS1DpClient, AsyncClient):
+    pass
+
+
+class AsyncSF1Client(SF1Client, AsyncClient):
+    pass
+
+
+class AsyncPLClient(PLClient, AsyncClient):
+    pass
+
+
+class AsyncCensus(object):
+    """
+    The asyncio counterpart of census.Census. Use it as an async context
+    manager, or call aclose() when done, to release the connection pool.
+    Pass http2=True (which needs h2) to multiplex the requests over
+    HTTP/2 connections.
+
+    rate_limiter, if given, must be a census.throttle.AsyncRateLimiter.
+    It is shared by every client, as a RateLimiter is by a Census.
+    """
+
+    ALL = ALL
+
+    def __init__(self, key, year=None, session=None, max_concurrency=20,
+                 metadata_cache=None, response_cache=None, rate_limiter=None,
+                 retry_policy=None, null_values=None, hooks=None, single_flight=True,
+                 http2=False, timeout=None):
+        if key == "" or key is None:
+            raise ValueError(
+                "As of May 12, 2026, all requests to the US Census API require an API key. "
+                "You may acquire one at https://api.census.gov/data/key_signup.html"
+            )
+
+        if rate_limiter is not None and not isinstance(rate_limiter, AsyncRateLimiter):
+            raise TypeError('AsyncCensus needs an AsyncRateLimiter, not a {}'.format(
+                type(rate_limiter).__name__))
+
+        if not session:
+            session = new_async_session(max_concurrency, http2, timeout)
+
+        self.session = session
+        self.session.headers.update({
+            'User-Agent': ('python-census/{} '.format(package_version()) +
+                           'github.com/datamade/census')
+        })
+
+        self.hooks = hooks if hooks is not None else Hooks()
+        client_kwargs = {
+            'field_types': FieldTypes(),
+            'metadata_cache': metadata_cache,
+            'response_cache': response_cache,
+            'limit': ConcurrencyLimit(max_concurrency),
+            'rate_limiter': rate_limiter,
+            'retry_policy': retry_policy or RetryPolicy(),
+            'null_values': null_values,
+            'hooks': self.hooks,
+            'single_flight': AsyncSingleFlight() if single_flight is True else single_flight or None,
+        }
+
+        self.acs5 = AsyncACS5Client(key, year, session, **client_kwargs)
+        self.acs3 = AsyncACS3Client(key, year, session, **client_kwargs)
+        self.acs1 = AsyncACS1Client(key, year, session, **client_kwargs)
+        self.acs5st = AsyncACS5StClient(key, year, session, **client_kwargs)
+        self.acs5dp = AsyncACS5DpClient(key, year, session, **client_kwargs)
+        self.acs3dp = AsyncACS3DpClient(key, year, session, **client_kwargs)
+        self.acs1dp = AsyncACS1DpClient(key, year, session, **client_kwargs)
+        self.sf1 = AsyncSF1Client(key, year, session, **client_kwargs)
+        self.pl = AsyncPLClient(key, year, session, **client_kwargs)
+
+    async def prefetch(self, datasets, years=None):
+        """
+        Warm the field types for each of datasets and years concurrently.
+        """
+        await gather_all(client._load_types(year)
+                         for client, year in prefetch_work(self, datasets, years))
+
+    async def aclose(self):
+        await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
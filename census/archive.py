@@ -0,0 +1,174 @@
+"""
+Record the API's responses to an archive file and replay them later
+without network access.
+
+    from census import Census
+    from census.archive import RecordingTransport, ReplayTransport
+
+    with Census("MY_API_KEY", session=RecordingTransport('run.jsonl.gz')) as c:
+        pipeline(c)
+
+    c = Census("MY_API_KEY", session=ReplayTransport('run.jsonl.gz'))
+    pipeline(c)
+
+Both are used as the session of a Census object or client. The archive
+is a gzip-compressed file with one JSON object per request. Requests
+are matched on URL and parameters, leaving out the API key, which is
+never written to the archive.
+"""
+import gzip
+import json
+import threading
+from collections import defaultdict
+
+from requests.structures import CaseInsensitiveDict
+
+from census.cache import atomic_write
+
+
+class ArchiveMissError(LookupError):
+    """ The archive has no response for a request.
+    """
+
+
+def request_key(url, params):
+    """
+    The key a request is archived under: its URL and parameters, without
+    the API key.
+    """
+    params = sorted((name, str(value)) for name, value in (params or {}).items()
+                    if name != 'key')
+    return json.dumps([url, params])
+
+
+class ArchivedResponse(object):
+    """
+    A response read from an archive, with the parts of the
+    requests.Response interface that the clients use. It holds nothing
+    that reading it changes, so one can be returned any number of times.
+    """
+
+    def __init__(self, status_code, headers, content, encoding=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        chunk_size = chunk_size or len(self.content) or 1
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def _entry(url, params, resp):
+    return {
+        'url': url,
+        'params': {name: str(value) for name, value in (params or {}).items() if name != 'key'},
+        'status': resp.status_code,
+        'headers': dict(resp.headers),
+        'encoding': resp.encoding,
+        # Lossless for any bytes, and readable when they are UTF-8.
+        'body': resp.content.decode('utf-8', errors='surrogateescape'),
+    }
+
+
+def _response(entry):
+    return ArchivedResponse(entry['status'], entry['headers'],
+                            entry['body'].encode('utf-8', errors='surrogateescape'),
+                            entry['encoding'])
+
+
+class RecordingTransport(object):
+    """
+    Sends requests through session (by default, a new one) and keeps
+    every response, writing them all to path on save() or close().
+    Streamed responses are read in full before they are returned.
+    """
+
+    def __init__(self, path, session=None):
+        if session is None:
+            from census.core import new_session
+            session = new_session()
+        self.path = path
+        self.session = session
+        self._entries = []
+        self._lock = threading.Lock()
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    def get(self, url, params=None, headers=None, stream=False, **kwargs):
+        resp = self.session.get(url, params=params, headers=headers, **kwargs)
+        try:
+            entry = _entry(url, params, resp)
+        finally:
+            if stream:
+                resp.close()
+        with self._lock:
+            self._entries.append(entry)
+        return _response(entry)
+
+    def save(self):
+        with self._lock:
+            lines = ''.join(json.dumps(entry) + '\n' for entry in self._entries)
+        atomic_write(self.path, gzip.compress(lines.encode('utf-8')))
+
+    def close(self):
+        self.save()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayTransport(object):
+    """
+    Answers requests from an archive written by RecordingTransport, held
+    in memory, without touching the network. A request that was
+    recorded several times gets the recorded responses in order, then
+    the last one again; one that wasn't recorded raises ArchiveMissError.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.headers = {}
+        self.hits = 0
+        self._responses = defaultdict(list)
+        self._served = defaultdict(int)
+        self._lock = threading.Lock()
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self._responses[request_key(entry['url'], entry['params'])].append(
+                    _response(entry))
+
+    def get(self, url, params=None, **kwargs):
+        key = request_key(url, params)
+        responses = self._responses.get(key)
+        if not responses:
+            raise ArchiveMissError('No recorded response for {} {}'.format(url, {
+                name: value for name, value in (params or {}).items() if name != 'key'}))
+
+        with self._lock:
+            served = self._served[key]
+            self._served[key] = served + 1
+            self.hits += 1
+        return responses[min(served, len(responses) - 1)]
+
+    def close(self):
+        pass
@@ -0,0 +1,316 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def default_cache_dir():
+    """
+    The per-user cache directory, honoring XDG_CACHE_HOME.
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'python-census')
+
+
+def atomic_write(path, data):
+    """
+    Write data (bytes) to path so that readers in any process see either
+    the old file or the complete new one, never a partial write.
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class MetadataCache(object):
+    """
+    On-disk cache for the variables.json and groups.json documents,
+    keyed by (dataset, year, document) and shared by every process
+    pointed at the same directory.
+
+    Entries younger than ttl seconds are served as they are. Older
+    entries are still served, but trigger a conditional request
+    (If-None-Match / If-Modified-Since) in a background thread that
+    refreshes the entry for the next reader.
+    """
+
+    def __init__(self, path=None, ttl=24 * 60 * 60, background=True):
+        self.path = path or default_cache_dir()
+        self.ttl = ttl
+        self.background = background
+        self._revalidating = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _filename(self, key):
+        dataset, year, document = key
+        name = '{}-{}-{}.json'.format(dataset.replace('/', '_'), year, document)
+        return os.path.join(self.path, name)
+
+    def _read(self, key):
+        try:
+            with open(self._filename(key), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, body, headers, previous=None):
+        previous = previous or {}
+        entry = {
+            'fetched': time.time(),
+            'etag': headers.get('ETag') or previous.get('etag'),
+            'last_modified': headers.get('Last-Modified') or previous.get('last_modified'),
+            'body': body,
+        }
+        atomic_write(self._filename(key), json.dumps(entry).encode('utf-8'))
+        return entry
+
+    def get(self, key, fetch):
+        """
+        Return the cached document for key. fetch(headers) must perform
+        the request with the given extra headers and return the response,
+        raising if it was neither a 200 nor a 304.
+        """
+        entry = self._read(key)
+        if entry is None:
+            resp = fetch({})
+            body = resp.json()
+            self._write(key, body, resp.headers)
+            return body
+
+        if time.time() - entry['fetched'] >= self.ttl:
+            if self.background:
+                self._revalidate_in_background(key, entry, fetch)
+            else:
+                entry = self._revalidate(key, entry, fetch)
+
+        return entry['body']
+
+    def _revalidate(self, key, entry, fetch):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = fetch(headers)
+        if resp.status_code == 304:
+            return self._write(key, entry['body'], resp.headers, previous=entry)
+        return self._write(key, resp.json(), resp.headers)
+
+    def _revalidate_in_background(self, key, entry, fetch):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                self._revalidate(key, entry, fetch)
+            except Exception:
+                # Keep serving the stale entry; the next read retries.
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    async def aget(self, key, fetch):
+        """
+        The asyncio counterpart of get: fetch(headers) is a coroutine
+        function, and a stale entry is revalidated in a task.
+        """
+        entry = self._read(key)
+        if entry is None:
+            resp = await fetch({})
+            body = resp.json()
+            self._write(key, body, resp.headers)
+            return body
+
+        if time.time() - entry['fetched'] >= self.ttl:
+            if self.background:
+                self._arevalidate_in_background(key, entry, fetch)
+            else:
+                entry = await self._arevalidate(key, entry, fetch)
+
+        return entry['body']
+
+    async def _arevalidate(self, key, entry, fetch):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = await fetch(headers)
+        if resp.status_code == 304:
+            return self._write(key, entry['body'], resp.headers, previous=entry)
+        return self._write(key, resp.json(), resp.headers)
+
+    def _arevalidate_in_background(self, key, entry, fetch):
+        import asyncio
+
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        async def run():
+            try:
+                await self._arevalidate(key, entry, fetch)
+            except Exception:
+                # Keep serving the stale entry; the next read retries.
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        # Keep a reference to the task until it finishes.
+        task = asyncio.ensure_future(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def clear(self):
+        """
+        Remove every cached document.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+class ResponseCache(object):
+    """
+    Size-bounded on-disk cache of raw data responses, keyed by a hash
+    of the normalized request: the endpoint URL (which carries the
+    dataset and year), the sorted fields and the geography.
+
+    Bodies are stored gzip-compressed. Once the compressed size of the
+    cache exceeds max_bytes, the least recently used entries are
+    evicted. hits, misses and evictions count the cache's activity in
+    this process.
+    """
+
+    suffix = '.json.gz'
+
+    def __init__(self, path=None, max_bytes=1024 * 1024 * 1024):
+        self.path = path or os.path.join(default_cache_dir(), 'responses')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+    @staticmethod
+    def key(url, fields, geo):
+        """
+        Hash a request so that the same fields and geography, in any
+        order, map to the same entry.
+        """
+        normalized = json.dumps([url, sorted(fields), sorted(geo.items())])
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key):
+        """
+        Return the cached body for key as bytes, or None.
+        """
+        try:
+            with open(self._filename(key), 'rb') as f:
+                body = gzip.decompress(f.read())
+        except (OSError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        try:
+            os.utime(self._filename(key))
+        except OSError:
+            pass
+        return body
+
+    def put(self, key, body):
+        """
+        Store body (bytes) under key, evicting old entries if the cache
+        has grown past max_bytes.
+        """
+        compressed = gzip.compress(body)
+        atomic_write(self._filename(key), compressed)
+
+        with self._lock:
+            self._size += len(compressed) - self._entries.pop(key, 0)
+            self._entries[key] = len(compressed)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._size -= size
+                self.evictions += 1
+                try:
+                    os.unlink(self._filename(old_key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    def clear(self):
+        """
+        Remove every cached response.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                try:
+                    os.unlink(self._filename(key))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._size = 0
@@ -1,15 +1,41 @@
+import codecs
+import json
+import random
+import re
+import sys
+import threading
+import time
 import warnings
-from functools import wraps, lru_cache
-from importlib.metadata import version
+from collections import Counter, namedtuple
+from collections.abc import Mapping
+from array import array
+from functools import lru_cache, wraps
+from operator import itemgetter
+from urllib.parse import quote, urlencode
+
+from census.flight import SingleFlight
+from census.hooks import Hooks, lap
+
+
+@lru_cache(maxsize=None)
+def package_version():
+    from importlib.metadata import version
+    return version('census')
+
+
+def __getattr__(name):
+    # Looking up the installed version is slow, so it is done on first use.
+    if name == '__version__':
+        return package_version()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-__version__ = version('census')
 
 ALL = '*'
 
 
 def new_session(*args, **kwargs):
-    import requests
-    return requests.session(*args, **kwargs)
+    from census.transport import RequestsTransport
+    return RequestsTransport(*args, **kwargs)
 
 
 class APIKeyError(Exception):
@@ -31,6 +57,14 @@ def list_or_str(v):
     return [v]
 
 
+def list_of_years(years):
+    """ Convert a year, or any iterable of years, into a list.
+    """
+    if isinstance(years, (str, int)):
+        return [years]
+    return list(years)
+
+
 def float_or_str(v):
     try:
         return float(v)
@@ -38,11 +72,30 @@ def float_or_str(v):
         return str(v)
 
 
+PREDICATE_TYPES = {
+    "fips-for": str,
+    "fips-in": str,
+    "int": float_or_str,
+    "long": float_or_str,
+    "float": float,
+    "string": str,
+}
+
+
 def supported_years(*years):
     def inner(func):
+        # Where year falls among the positional arguments, after self.
+        code = func.__code__
+        parameters = code.co_varnames[:code.co_argcount]
+        position = parameters.index('year') - 1 if 'year' in parameters else None
+
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            year = kwargs.get('year', self.default_year)
+            year = kwargs.get('year')
+            if year is None and position is not None and len(args) > position:
+                year = args[position]
+            if year is None:
+                year = self.default_year
             _years = years if years else self.years
             if int(year) not in _years:
                 raise UnsupportedYearException(
@@ -52,50 +105,969 @@ def supported_years(*years):
     return inner
 
 
+TRANSIENT_ERROR = (
+    "There was an error while running your query.  We've logged the error "
+    "and we'll correct it ASAP.  Sorry for the inconvenience."
+)
+
+
 def retry_on_transient_error(func):
 
+    @wraps(func)
     def wrapper(self, *args, **kwargs):
-        for _ in range(max(self.retries - 1, 0)):
+        attempt = 1
+        while True:
             try:
-                result = func(self, *args, **kwargs)
-            except CensusException as e:
-                if "There was an error while running your query.  We've logged the error and we'll correct it ASAP.  Sorry for the inconvenience." in str(e):
-                    pass
-                else:
+                return func(self, *args, **kwargs)
+            except Exception as e:
+                delay = self.retry_policy.retry_delay(attempt, e)
+                if delay is None:
                     raise
-            else:
-                return result
-        else:
-            return func(self, *args, **kwargs)
+            time.sleep(delay)
+            attempt += 1
 
     return wrapper
 
 
+def geo_clauses(value):
+    """
+    Split an 'in' value such as 'state:06 county:*' into
+    [('state', '06'), ('county', '*')].
+    """
+    return re.findall(r'\s*(.+?):(\S+)', value or '')
+
+
+def geo_key(row, fields):
+    """
+    The values of a row's geography columns: every column that was not
+    one of the requested fields.
+    """
+    return tuple(value for header, value in row.items() if header not in fields)
+
+
 def chunks(l, n):
     """Yield successive n-sized chunks from l."""
     for i in range(0, len(l), n):
         yield l[i:i + n]
 
 
+def pack_codes(codes, budget):
+    """
+    Split geography codes into lists that fit in budget characters of
+    URL once joined with (URL-encoded) commas.
+    """
+    packs = []
+    pack, size = [], 0
+    for code in codes:
+        cost = len(quote(code, safe=''))
+        if pack and size + 3 + cost > budget:
+            packs.append(pack)
+            pack, size = [], 0
+        size += cost + (3 if pack else 0)
+        pack.append(code)
+    if pack:
+        packs.append(pack)
+    return packs
+
+
 def merge(dicts):
     return dict(item for d in dicts for item in d.items())
 
 
+OUTPUTS = ('dicts', 'records', 'columns', 'numpy')
+
+TRANSPORTS = ('requests', 'httpx', 'http2')
+
+
+ACS_ANNOTATIONS = frozenset([
+    -111111111.0, -222222222.0, -333333333.0, -555555555.0,
+    -666666666.0, -888888888.0, -999999999.0,
+])
+
+
+class Record(Mapping):
+    """
+    A read-only row of a response. Every record of a response shares one
+    {header: position} index and keeps its values in a tuple, so a record
+    costs a fraction of the memory of a dict with the same items. Records
+    support the usual mapping operations (row['NAME'], row.get, in, keys,
+    items, dict(row)) and compare equal to dicts with the same items.
+    """
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return 'Record({!r})'.format(dict(zip(self._index, self._values)))
+
+    def __reduce__(self):
+        return (Record, (self._index, self._values))
+
+
+def _cast_values(cast, column):
+    return [cast(value) if value is not None else None for value in column]
+
+
+class RowDecoder(object):
+    """
+    Casts the data rows of responses with a given header row.
+
+    For columns, numeric columns are converted with a single
+    map(float, column), and only fall back to casting value by value
+    when that fails. String columns that hold nothing but strings and
+    nulls are kept as they are. For dicts and records, each row is cast
+    in one pass, with a map(float, ...) over each run of adjacent
+    numeric columns. Values in sentinels (e.g. ACS_ANNOTATIONS) become
+    None in numeric columns. Use compile_decoder to share decoders
+    between responses.
+    """
+
+    def __init__(self, headers, types, sentinels=None):
+        self.headers = tuple(headers)
+        self.types = tuple(types)
+        self.sentinels = sentinels or None
+        self.index = {header: position for position, header in enumerate(self.headers)}
+        self.numeric = tuple(cast in (float, float_or_str) for cast in self.types)
+        self.identity = not self.sentinels and all(cast is str for cast in self.types)
+
+        # Slices over the runs of adjacent numeric columns, and the other
+        # columns that need a cast.
+        self.runs = []
+        for position, numeric in enumerate(self.numeric):
+            if not numeric:
+                continue
+            if self.runs and self.runs[-1].stop == position:
+                self.runs[-1] = slice(self.runs[-1].start, position + 1)
+            else:
+                self.runs.append(slice(position, position + 1))
+        self.others = [(position, cast) for position, (cast, numeric)
+                       in enumerate(zip(self.types, self.numeric))
+                       if not numeric and cast is not str]
+
+    def column(self, index, column):
+        """
+        Cast one column of values.
+        """
+        cast = self.types[index]
+        if self.numeric[index]:
+            try:
+                values = list(map(float, column))
+            except (TypeError, ValueError):
+                values = _cast_values(cast, column)
+            if self.sentinels and not self.sentinels.isdisjoint(values):
+                values = [None if value in self.sentinels else value for value in values]
+            return values
+
+        if cast is str and set(map(type, column)) <= {str, type(None)}:
+            return list(column)
+        return _cast_values(cast, column)
+
+    def columns(self, data):
+        """
+        Return the cast columns of data, in header order.
+        """
+        if not data:
+            return [[] for _ in self.headers]
+        return [self.column(index, column) for index, column in enumerate(zip(*data))]
+
+    def values(self, data):
+        """
+        Yield the cast values of each row of data, as a list.
+        """
+        runs, others, sentinels = self.runs, self.others, self.sentinels
+        for row in data:
+            values = list(row)
+            try:
+                for run in runs:
+                    values[run] = map(float, values[run])
+            except (TypeError, ValueError):
+                yield self.cast(row)
+                continue
+            for position, cast in others:
+                if values[position] is not None:
+                    values[position] = cast(values[position])
+            if sentinels:
+                for run in runs:
+                    if not sentinels.isdisjoint(values[run]):
+                        values[run] = [None if value in sentinels else value
+                                       for value in values[run]]
+            yield values
+
+    def dicts(self, data):
+        """
+        Return one dict per row of data.
+        """
+        headers = self.headers
+        if self.identity:
+            return [dict(zip(headers, row)) for row in data]
+        return [dict(zip(headers, values)) for values in self.values(data)]
+
+    def records(self, data):
+        """
+        Return one Record per row of data, all sharing one index.
+        """
+        index = self.index
+        if self.identity:
+            return [Record(index, tuple(row)) for row in data]
+        return [Record(index, tuple(values)) for values in self.values(data)]
+
+    def cast(self, values):
+        """
+        Cast a single row value by value, returning a list.
+        """
+        row = []
+        for cast, numeric, value in zip(self.types, self.numeric, values):
+            if value is not None:
+                value = cast(value)
+                if numeric and self.sentinels and value in self.sentinels:
+                    value = None
+            row.append(value)
+        return row
+
+    def row(self, values):
+        """
+        Cast a single row, for callers that cannot wait for the rest of
+        the response.
+        """
+        return dict(zip(self.headers, self.cast(values)))
+
+
+@lru_cache(maxsize=256)
+def compile_decoder(headers, types, sentinels=None):
+    """
+    Return the RowDecoder for a tuple of headers and a tuple of types,
+    building it the first time it is asked for.
+    """
+    return RowDecoder(headers, types, sentinels)
+
+
+def decode_columns(headers, types, data, use_numpy=False, sentinels=None):
+    """
+    Transpose the rows of a response into {header: column}, casting each
+    column in one pass.
+
+    Numeric columns become array('d') (or float64 NumPy arrays), with
+    missing values, and values in sentinels, as NaN. A numeric column
+    holding a value that does not parse as a number stays a list (or
+    object array) of values cast one by one. Other columns are lists (or
+    NumPy arrays of str, or of objects when values are missing).
+    """
+    if use_numpy:
+        import numpy
+
+    decoder = compile_decoder(tuple(headers), tuple(types), sentinels)
+    nan = float('nan')
+    columns = {}
+    transposed = zip(*data) if data else [()] * len(headers)
+    for index, (header, column) in enumerate(zip(headers, transposed)):
+        if decoder.numeric[index]:
+            try:
+                values = array('d', map(float, column))
+            except (TypeError, ValueError):
+                pass
+            else:
+                if sentinels and not sentinels.isdisjoint(values):
+                    values = array('d', [nan if value in sentinels else value for value in values])
+                columns[header] = numpy.frombuffer(values) if use_numpy else values
+                continue
+
+        values = decoder.column(index, column)
+        if decoder.numeric[index] and set(map(type, values)) <= {float, type(None)}:
+            values = array('d', [nan if value is None else value for value in values])
+            columns[header] = numpy.frombuffer(values) if use_numpy else values
+        elif use_numpy:
+            if None in values or not all(isinstance(value, str) for value in values):
+                columns[header] = numpy.array(values, dtype=object)
+            else:
+                columns[header] = numpy.array(values, dtype=str)
+        else:
+            columns[header] = values
+    return columns
+
+
+def structured_array(columns):
+    """
+    Combine {name: 1-d NumPy array} into one NumPy structured array.
+    """
+    import numpy
+
+    length = len(next(iter(columns.values()))) if columns else 0
+    result = numpy.empty(length, dtype=[(name, column.dtype) for name, column in columns.items()])
+    for name, column in columns.items():
+        result[name] = column
+    return result
+
+
+def concat_results(results, output='dicts'):
+    """
+    Concatenate results for different geographies with the same fields.
+    """
+    results = list(results)
+    if output in ('dicts', 'records'):
+        return [row for rows in results for row in rows]
+    if output == 'numpy':
+        import numpy
+        results = [result for result in results if len(result)]
+        return numpy.concatenate(results) if results else structured_array({})
+
+    columns = {}
+    for result in results:
+        for name, column in result.items():
+            if name in columns:
+                if type(columns[name]) is not type(column):
+                    columns[name] = list(columns[name])
+                    column = list(column)
+                columns[name] += column
+            else:
+                columns[name] = column[:]
+    return columns
+
+
+def tag_result(result, name, value, output='dicts'):
+    """
+    Add a column called name, holding value for every row, to a result.
+    """
+    if output == 'dicts':
+        for row in result:
+            row[name] = value
+        return result
+    if output == 'records':
+        indexes = {}
+        tagged = []
+        for row in result:
+            index = indexes.get(id(row._index))
+            if index is None:
+                index = indexes[id(row._index)] = dict(row._index)
+                index[name] = len(row._index)
+            tagged.append(Record(index, tuple(row._values) + (value,)))
+        return tagged
+    if output == 'numpy':
+        from numpy.lib import recfunctions
+        return recfunctions.append_fields(result, name, [value] * len(result), usemask=False)
+
+    length = len(next(iter(result.values()))) if result else 0
+    result[name] = array('l', [value]) * length
+    return result
+
+
+def iter_text(chunks, encoding=None):
+    """
+    Decode an iterable of byte chunks into text incrementally.
+    """
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+class JSONArrayParser(object):
+    """
+    Parse a JSON array of arrays, such as an API response, as it arrives:
+    feed returns the elements completed by each chunk of text, holding
+    only the current element in memory.
+    """
+
+    whitespace = ' \t\n\r'
+
+    def __init__(self):
+        self.done = False
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._started = False
+
+    def feed(self, chunk):
+        """
+        Return the elements completed by chunk. Raises a ValueError,
+        holding the unparsed text, if the response is not an array.
+        """
+        values = []
+        if self.done:
+            return values
+        buffer = self._buffer = self._buffer[self._pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in self.whitespace:
+                pos += 1
+            if pos == len(buffer):
+                break
+
+            if not self._started:
+                if buffer[pos] != '[':
+                    raise ValueError(buffer[pos:])
+                self._started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ',':
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                self.done = True
+                break
+
+            try:
+                value, pos = self._decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # The element continues in the next chunk.
+                break
+            values.append(value)
+
+        self._pos = pos
+        return values
+
+    def close(self):
+        if not self.done:
+            raise ValueError('Response ended before the end of the JSON array')
+
+
+def iter_json_array(chunks):
+    """
+    Yield the elements of a JSON array of arrays, such as an API
+    response, from an iterable of text chunks, holding only the current
+    element in memory.
+    """
+    parser = JSONArrayParser()
+    chunks = iter(chunks)
+
+    for chunk in chunks:
+        try:
+            values = parser.feed(chunk)
+        except ValueError as ex:
+            raise ValueError(str(ex) + ''.join(chunks))
+        for value in values:
+            yield value
+        if parser.done:
+            return
+
+    parser.close()
+
+
+def join_tables(tables, field_chunks):
+    """
+    Hash join the raw (headers, rows) responses for several chunks of
+    fields over the same geographies, in one pass over each response.
+
+    Rows are matched on GEO_ID when every chunk has it, and otherwise on
+    the geography columns (state, county, tract, ...) that the API
+    returns after the requested fields. Rows are returned in the order
+    they first appear. A row missing from some chunks is kept, with None
+    for that chunk's fields, and reported with an UnmatchedRowsWarning.
+    Chunks answered with no content are treated as missing every row.
+    """
+    present = [(table, chunk_fields) for table, chunk_fields in zip(tables, field_chunks)
+               if table[0]]
+    if not present:
+        return [], []
+    empty = [chunk_fields for (headers, _), chunk_fields in zip(tables, field_chunks)
+             if not headers]
+    tables, field_chunks = zip(*present)
+
+    use_geo_id = all('GEO_ID' in headers for headers, _ in tables)
+
+    merged_headers = []
+    positions = {}
+    layouts = []
+    for (headers, _), chunk_fields in zip(tables, field_chunks):
+        if use_geo_id:
+            key_columns = [headers.index('GEO_ID')]
+        else:
+            key_columns = [i for i, header in enumerate(headers) if header not in chunk_fields]
+        targets = []
+        for header in headers:
+            if header not in positions:
+                positions[header] = len(merged_headers)
+                merged_headers.append(header)
+            targets.append(positions[header])
+        layouts.append((itemgetter(*key_columns), targets))
+
+    width = len(merged_headers)
+    merged = {}
+    for (_, data), (key, targets) in zip(tables, layouts):
+        for row in data:
+            row_key = key(row)
+            entry = merged.get(row_key)
+            if entry is None:
+                entry = merged[row_key] = [[None] * width, 0]
+            values = entry[0]
+            for target, value in zip(targets, row):
+                values[target] = value
+            entry[1] += 1
+
+    for chunk_fields in empty:
+        for field in chunk_fields:
+            if field not in positions:
+                positions[field] = len(merged_headers)
+                merged_headers.append(field)
+    if len(merged_headers) > width:
+        padding = [None] * (len(merged_headers) - width)
+        for entry in merged.values():
+            entry[0].extend(padding)
+
+    unmatched = [key for key, (_, count) in merged.items()
+                 if empty or count != len(tables)]
+    if unmatched:
+        warnings.warn(
+            '{} geographies were missing from some of the field chunks and have '
+            'None for those fields: {}'.format(
+                len(unmatched), ', '.join(str(key) for key in unmatched[:10])),
+            UnmatchedRowsWarning, stacklevel=3)
+
+    return merged_headers, [values for values, _ in merged.values()]
+
+
+class StreamJoin(object):
+    """
+    Join the streamed rows of the last chunk of fields on to the rows of
+    the chunks before it, held in indexes keyed by geography (see
+    geo_key), as iter_get does. Each index is emptied as it is joined.
+    """
+
+    def __init__(self, field_chunks, indexes):
+        self.field_chunks = field_chunks
+        self.indexes = indexes
+        self.last_fields = set(field_chunks[-1])
+        self.unmatched = []
+
+    def join(self, row):
+        if not self.indexes:
+            return row
+        key = geo_key(row, self.last_fields)
+        geography = {header: value for header, value in row.items()
+                     if header not in self.last_fields}
+        merged = self._merged(key, geography,
+                              [index.pop(key, None) for index in self.indexes])
+        merged.update(row)
+        return merged
+
+    def leftovers(self):
+        """
+        Yield the rows that were missing from the last chunk, with None
+        for its fields, then warn about every unmatched row.
+        """
+        for i, (index, chunk_fields) in enumerate(zip(self.indexes, self.field_chunks)):
+            for key, row in list(index.items()):
+                geography = {header: value for header, value in row.items()
+                             if header not in chunk_fields}
+                found = [None] * i + [later.pop(key, None) for later in self.indexes[i:]]
+                merged = self._merged(key, geography, found)
+                for field in self.field_chunks[-1]:
+                    merged[field] = None
+                if all(found):
+                    self.unmatched.append(key)
+                yield merged
+
+        if self.unmatched:
+            warnings.warn(
+                '{} geographies were missing from some of the field chunks and have '
+                'None for those fields: {}'.format(
+                    len(self.unmatched),
+                    ', '.join(str(key) for key in self.unmatched[:10])),
+                UnmatchedRowsWarning, stacklevel=3)
+
+    def _merged(self, key, geography, found):
+        """
+        A row in get's column order: the first chunk's fields, the
+        geography, then the other chunks' fields, with None for the
+        chunks where found has no row.
+        """
+        merged = dict.fromkeys(self.field_chunks[0])
+        merged.update(geography)
+        for chunk_fields, row in zip(self.field_chunks, found):
+            if row is None:
+                for field in chunk_fields:
+                    merged.setdefault(field, None)
+            else:
+                merged.update(row)
+        if not all(found):
+            self.unmatched.append(key)
+        return merged
+
+
+def prefetch_work(census, datasets, years):
+    """
+    The (client, year) pairs to prefetch for datasets (attribute names of
+    census, such as 'acs5') and years, by default each dataset's default
+    year. Raises UnsupportedYearException for a year a dataset lacks.
+    """
+    work = []
+    for name in list_or_str(datasets):
+        client = getattr(census, name)
+        for year in list_of_years(years if years is not None else client.default_year):
+            if int(year) not in client.years:
+                raise UnsupportedYearException(
+                    '{} is not available in {}. Available years include {}'.format(
+                        name, year, client.years))
+            work.append((client, year))
+    return work
+
+
+def parallel_map(func, items, max_workers):
+    """
+    Apply func to each item using up to max_workers threads and return
+    the results in the same order as items. If any call raises, the
+    calls that have not started yet are cancelled and the first error
+    is re-raised.
+    """
+    items = list(items)
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    futures = [executor.submit(func, item) for item in items]
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+
+def imap_unordered(func, items, max_workers):
+    """
+    Like parallel_map, but yield each result as soon as its call
+    finishes, in whatever order that is. At most max_workers calls are
+    submitted ahead of the consumer, so finished results don't pile up
+    when it is slower than the requests.
+    """
+    if max_workers is None or max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class FieldTypes(object):
+    """
+    Cast functions for every variable of a dataset, keyed by
+    (dataset, year). Each map is built once from the dataset's
+    variables.json and can be shared by any number of clients.
+
+    A load that fails is not retried for failure_ttl seconds: callers in
+    the meantime get the same error without another download.
+    """
+
+    def __init__(self, failure_ttl=60.0):
+        self.failure_ttl = failure_ttl
+        self._maps = {}
+        self._failures = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, dataset, year, load):
+        """
+        Return the type map for (dataset, year), calling load() to fetch
+        the variable definitions the first time it is requested. Callers
+        asking for the same map at the same time wait on a single load.
+        """
+        types = self.peek(dataset, year)
+        if types is not None:
+            return types
+
+        key = (dataset, int(year))
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._maps:
+                self.raise_recent_failure(dataset, year)
+                try:
+                    self.store(dataset, year, load())
+                except Exception as e:
+                    self.fail(dataset, year, e)
+                    raise
+        return self._maps[key]
+
+    def raise_recent_failure(self, dataset, year):
+        """
+        Re-raise the error of a load for (dataset, year) that failed less
+        than failure_ttl seconds ago.
+        """
+        failure = self._failures.get((dataset, int(year)))
+        if failure is not None and time.monotonic() - failure[0] < self.failure_ttl:
+            raise failure[1]
+
+    def fail(self, dataset, year, error):
+        """
+        Record that loading (dataset, year) failed with error.
+        """
+        self._failures[(dataset, int(year))] = (time.monotonic(), error)
+
+    def peek(self, dataset, year):
+        """
+        Return the type map for (dataset, year) if it has been loaded.
+        """
+        return self._maps.get((dataset, int(year)))
+
+    def store(self, dataset, year, variables):
+        """
+        Build and keep the type map for (dataset, year) from the
+        variables of a variables.json document.
+        """
+        types = {
+            field: PREDICATE_TYPES.get(elem.get("predicateType", "string"), str)
+            for field, elem in variables.items()
+        }
+        self._maps[(dataset, int(year))] = types
+        return types
+
+
+Endpoints = namedtuple('Endpoints', ['endpoint_url', 'definitions_url', 'definition_url', 'groups_url',
+                                     'group_url'])
+
+ACS_ENDPOINTS = Endpoints(
+    'https://api.census.gov/data/%s/acs/%s',
+    'https://api.census.gov/data/%s/acs/%s/variables.json',
+    'https://api.census.gov/data/%s/acs/%s/variables/%s.json',
+    'https://api.census.gov/data/%s/acs/%s/groups.json',
+    'https://api.census.gov/data/%s/acs/%s/groups/%s.json',
+)
+
+DEC_ENDPOINTS = Endpoints(
+    'https://api.census.gov/data/%s/dec/%s',
+    'https://api.census.gov/data/%s/dec/%s/variables.json',
+    'https://api.census.gov/data/%s/dec/%s/variables/%s.json',
+    'https://api.census.gov/data/%s/dec/%s/groups.json',
+    'https://api.census.gov/data/%s/dec/%s/groups/%s.json',
+)
+
+
 class CensusException(Exception):
-    pass
+
+    def __init__(self, *args, **kwargs):
+        self.response = kwargs.pop('response', None)
+        super(CensusException, self).__init__(*args, **kwargs)
+
+    @property
+    def status_code(self):
+        return getattr(self.response, 'status_code', None)
 
 
 class UnsupportedYearException(CensusException):
     pass
 
 
+class UnmatchedRowsWarning(UserWarning):
+    """ Some geographies were only returned for some of the field chunks.
+    """
+
+
+class ThrottledException(CensusException):
+    """ The API refused a request because of load (429 or 503).
+    """
+
+
+def default_retry_exceptions():
+    """
+    Connection errors and timeouts from the standard library and from
+    whichever HTTP libraries are loaded.
+    """
+    exceptions = [ConnectionError, TimeoutError]
+    if 'requests' in sys.modules:
+        requests = sys.modules['requests']
+        exceptions += [requests.ConnectionError, requests.Timeout]
+    if 'httpx' in sys.modules:
+        exceptions.append(sys.modules['httpx'].TransportError)
+    return tuple(exceptions)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed query is retried and how long to wait first.
+
+    statuses and exceptions are the retryable HTTP status codes and
+    exception types. Either may be a sequence, allowing max_attempts
+    attempts for each, or a dict giving the number of attempts per status
+    or type. Errors whose message contains one of messages (by default,
+    the API's generic "error while running your query") are retried too.
+
+    The n-th retry waits backoff * 2 ** (n - 1) seconds, capped at
+    max_backoff and, with jitter, drawn uniformly from zero to that
+    bound. A Retry-After header on the response takes precedence, up to
+    max_retry_after. budget caps the retries made under this policy
+    across every call that shares it; retries, sleep_time and reasons
+    record what it has done.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30.0,
+                 jitter=True, budget=None,
+                 statuses=(429, 500, 502, 503, 504), exceptions=None,
+                 messages=(TRANSIENT_ERROR,), max_retry_after=120.0):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget = budget
+        self.statuses = self._rules(statuses)
+        # By default the HTTP libraries' exceptions are looked up when an
+        # error occurs, as they may not have been imported yet.
+        self.exceptions = self._rules(exceptions) if exceptions else None
+        self.messages = messages
+        self.max_retry_after = max_retry_after
+
+        self.retries = 0
+        self.sleep_time = 0.0
+        self.reasons = Counter()
+        self._lock = threading.Lock()
+
+    def replace(self, **changes):
+        """
+        Return a copy of this policy with changes to its settings, e.g.
+        replace(max_attempts=1). The copy records its own retries,
+        sleep_time and reasons, counting from zero.
+        """
+        import copy
+
+        policy = copy.copy(self)
+        for name, value in changes.items():
+            if not hasattr(policy, name):
+                raise TypeError('RetryPolicy has no setting {!r}'.format(name))
+            setattr(policy, name, value)
+        policy.retries = 0
+        policy.sleep_time = 0.0
+        policy.reasons = Counter()
+        policy._lock = threading.Lock()
+        return policy
+
+    @staticmethod
+    def _rules(rules):
+        if isinstance(rules, dict):
+            return dict(rules)
+        return dict.fromkeys(rules)
+
+    def _attempts(self, error):
+        """
+        The number of attempts allowed for error, and the reason to record.
+        """
+        if isinstance(error, CensusException):
+            if error.status_code in self.statuses:
+                return self.statuses[error.status_code], error.status_code
+            if any(message in str(error) for message in self.messages):
+                return None, 'message'
+            return 0, None
+
+        exceptions = self.exceptions
+        if exceptions is None:
+            exceptions = self._rules(default_retry_exceptions())
+        for exception, attempts in exceptions.items():
+            if isinstance(error, exception):
+                return attempts, type(error).__name__
+        return 0, None
+
+    def retry_delay(self, attempt, error):
+        """
+        Return how many seconds to wait before retrying after error failed
+        the given attempt (counting from 1), or None if it should not be
+        retried.
+        """
+        attempts, reason = self._attempts(error)
+        if attempts is None:
+            attempts = self.max_attempts
+        if attempt >= attempts:
+            return None
+
+        delay = self._retry_after(error)
+        if delay is None:
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            if self.jitter:
+                delay = random.uniform(0, delay)
+
+        with self._lock:
+            if self.budget is not None and self.retries >= self.budget:
+                return None
+            self.retries += 1
+            self.sleep_time += delay
+            self.reasons[reason] += 1
+        return delay
+
+    def _retry_after(self, error):
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        value = headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            delay = retry_at.timestamp() - time.time()
+        return min(max(delay, 0.0), self.max_retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'retries': self.retries,
+                'sleep_time': self.sleep_time,
+                'reasons': dict(self.reasons),
+            }
+
+
 class Client(object):
+    """
+    A client for one Census dataset.
+
+    Clients hold no per-request state: the URLs for a year are resolved
+    on each call and the shared caches are locked, so a single client
+    (or Census object) can be used from many threads at once, including
+    for queries against different years.
+    """
+
     endpoint_url = 'https://api.census.gov/data/%s/%s'
     definitions_url = 'https://api.census.gov/data/%s/%s/variables.json'
     definition_url = 'https://api.census.gov/data/%s/%s/variables/%s.json'
     groups_url = 'https://api.census.gov/data/%s/%s/groups.json'
+    group_url = 'https://api.census.gov/data/%s/%s/groups/%s.json'
 
-    def __init__(self, key, year=None, session=None, retries=3):
+    max_url_length = 4000
+
+    def __init__(self, key, year=None, session=None, retries=3, max_workers=8,
+                 field_types=None, metadata_cache=None, response_cache=None,
+                 rate_limiter=None, retry_policy=None, null_values=None, hooks=None,
+                 single_flight=None):
         if key == "" or key is None:
             raise ValueError(
                 "As of May 12, 2026, all requests to the US Census API require an API key. "
@@ -105,7 +1077,25 @@ class Client(object):
         self.session = session or new_session()
         if year:
             self.default_year = year
-        self.retries = retries
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=retries)
+        self.max_workers = max_workers
+        self.field_types = field_types or FieldTypes()
+        self.metadata_cache = metadata_cache
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.null_values = frozenset(null_values) if null_values else None
+        self.hooks = hooks if hooks is not None else Hooks()
+        self.single_flight = single_flight
+
+    @property
+    def retries(self):
+        return self.retry_policy.max_attempts
+
+    @retries.setter
+    def retries(self, value):
+        # The policy may be shared with other clients, so replace it
+        # rather than changing it.
+        self.retry_policy = self.retry_policy.replace(max_attempts=value)
 
     def tables(self, year=None):
         """
@@ -116,34 +1106,54 @@ class Client(object):
             year = self.default_year
 
         # Query the table metadata as raw JSON
-        tables_url = self.groups_url % (year, self.dataset)
-        resp = self.session.get(tables_url, params={"key": self._key})
+        tables_url = self._endpoints(year).groups_url % (year, self.dataset)
 
         # Pass it out
-        return resp.json()['groups']
+        return self._metadata(tables_url, year, 'groups')['groups']
+
+    def _variables(self, year):
+        """
+        Fetch the variable definitions for year from variables.json.
+        """
+        fields_url = self._endpoints(year).definitions_url % (year, self.dataset)
+        return self._metadata(fields_url, year, 'variables')['variables']
+
+    def _metadata(self, url, year, document):
+        """
+        Fetch a metadata document, reading through the metadata cache
+        when one is configured.
+        """
+        def fetch(headers=None):
+            resp = self._request(url, {"key": self._key}, headers=headers)
+            if resp.status_code not in (200, 304):
+                raise CensusException(resp.text, response=resp)
+            return resp
+
+        if self.metadata_cache is None:
+            return fetch().json()
+        return self.metadata_cache.get((self.dataset, int(year), document), fetch)
 
     @supported_years()
     def fields(self, year=None, flat=False):
         if year is None:
             year = self.default_year
 
-        data = {}
-
-        fields_url = self.definitions_url % (year, self.dataset)
+        return self._fields(self._variables(year), flat)
 
-        resp = self.session.get(fields_url, params={"key": self._key})
-        obj = resp.json()
+    @staticmethod
+    def _fields(variables, flat):
+        data = {}
 
         if flat:
 
-            for key, elem in obj['variables'].items():
+            for key, elem in variables.items():
                 if key in ['for', 'in']:
                     continue
                 data[key] = "{}: {}".format(elem['concept'], elem['label'])
 
         else:
 
-            data = obj['variables']
+            data = variables
             if 'for' in data:
                 data.pop("for", None)
             if 'in' in data:
@@ -151,33 +1161,420 @@ class Client(object):
 
         return data
 
-    def get(self, fields, geo, year=None, **kwargs):
+    def get(self, fields, geo, year=None, output='dicts', **kwargs):
+        """
+        The API only accepts up to 50 fields on each query. Longer field
+        lists are requested in chunks, concurrently, using up to
+        max_workers threads on the shared session. The responses are
+        hash joined on GEO_ID or, since GEO_ID is not reliably present in
+        pre-2010 requests, on the geography columns. Rows come in the
+        order the API returned them.
+
+        By default the result is a list with one dict per geography. Pass
+        output='records' for compact read-only Record mappings,
+        output='columns' for a dict of typed columns instead, or
+        output='numpy' for a NumPy structured array.
+        """
+        field_chunks = list(chunks(list_or_str(fields), 49))
+        if len(field_chunks) <= 1:
+            return self.query(fields, geo, year, output=output, **kwargs)
+
+        if output not in OUTPUTS:
+            raise ValueError('output must be one of {}'.format(', '.join(OUTPUTS)))
+        if year is None:
+            year = self.default_year
+
+        if int(year) > 2009:
+            field_chunks = [list(chunk) + ['GEO_ID'] for chunk in field_chunks]
+
+        def fetch(forty_nine_fields):
+            with self.hooks.instrument('chunk', self.dataset, year, geo, forty_nine_fields) as event:
+                return self._fetch(forty_nine_fields, geo, year, event=event, **kwargs)
+
+        with self.hooks.instrument('get', self.dataset, year, geo, fields) as event:
+            start = time.perf_counter()
+            tables = parallel_map(fetch, field_chunks, self.max_workers)
+            start = lap(event, 'fetch', start)
+            headers, data = join_tables(tables, field_chunks)
+            start = lap(event, 'join', start)
+
+            types = self._header_types(headers, year)
+            start = lap(event, 'types', start)
+            result = self._decode(headers, types, data, output)
+            lap(event, 'cast', start)
+            if event is not None:
+                event.rows = len(data)
+            return result
+
+    def fan_out(self, fields, geo, year=None, max_workers=None, **kwargs):
+        """
+        Like get, but any level of geo['in'] may be Census.ALL, e.g.
+        {'for': 'block group:*', 'in': 'state:* county:*'}.
+
+        The API only accepts wildcards in 'for', so the parent geographies
+        are discovered level by level, then one get is issued per parent,
+        up to max_workers (by default, the client's max_workers) at a time.
+        The results are returned as one list, in parent order.
+        """
+        if year is None:
+            year = self.default_year
+        max_workers = max_workers or self.max_workers
+
+        results = parallel_map(
+            lambda child: self.get(fields, child, year=year, **kwargs),
+            self._fan_out_geos(geo, year, max_workers),
+            max_workers)
+
+        return concat_results(results, kwargs.get('output', 'dicts'))
+
+    def iter_fan_out(self, fields, geo, year=None, max_workers=None, **kwargs):
+        """
+        Like fan_out, but yields the result of each parent geography's get
+        as soon as it arrives, in no particular order, while the requests
+        for the others are still in flight.
+        """
+        if year is None:
+            year = self.default_year
+        max_workers = max_workers or self.max_workers
+
+        return imap_unordered(
+            lambda child: self.get(fields, child, year=year, **kwargs),
+            self._fan_out_geos(geo, year, max_workers),
+            max_workers)
+
+    def _fan_out_geos(self, geo, year, max_workers):
         """
-        The API only accepts up to 50 fields on each query.
-        Chunk requests, and use the unique GEO_ID to match up the chunks
-        in case the responses are in different orders.
-        GEO_ID is not reliably present in pre-2010 requests.
+        Expand the wildcards in geo['in'] into one geography per parent,
+        discovering the parents level by level.
         """
-        sort_by_geoid = len(fields) > 49 and (not year or year > 2009)
-        all_results = (self.query(forty_nine_fields, geo, year, sort_by_geoid=sort_by_geoid, **kwargs)
-                       for forty_nine_fields in chunks(fields, 49))
-        merged_results = [merge(result) for result in zip(*all_results)]
+        parents = [[]]
+        for level, code in geo_clauses(geo.get('in')):
+            if code != ALL:
+                parents = [parent + [(level, code)] for parent in parents]
+                continue
 
-        return merged_results
+            def children(parent, level=level):
+                rows = self.query(['NAME'], self._geo(level + ':' + ALL, parent), year)
+                return [parent + [(level, row[level])] for row in rows]
+
+            parents = [child
+                       for found in parallel_map(children, parents, max_workers)
+                       for child in sorted(found)]
+
+        return [self._geo(geo['for'], parent) for parent in parents]
+
+    def batch(self, fields, geos, year=None, max_workers=None, max_url_length=None, **kwargs):
+        """
+        Look up fields for many single geographies, such as
+        [{'for': 'place:04000', 'in': 'state:06'}, ...], in as few
+        requests as possible.
+
+        Geographies at the same level and under the same parent are
+        packed into comma-separated 'for' lists, as many codes per request
+        as keep the URL within max_url_length (by default, the client's
+        max_url_length). The requests are sent concurrently, up to
+        max_workers at a time, and the result has one entry per geography
+        in geos: its row, or None if the API returned no row for it.
+        """
+        if year is None:
+            year = self.default_year
+
+        requests = self._batch_requests(fields, geos, year, max_url_length, kwargs)
+        results = parallel_map(
+            lambda geo: self.get(fields, geo, year, **kwargs),
+            requests,
+            max_workers or self.max_workers)
+
+        return self._batch_rows(geos, requests, results)
+
+    def _batch_requests(self, fields, geos, year, max_url_length, kwargs):
+        if kwargs.get('output', 'dicts') not in ('dicts', 'records'):
+            raise ValueError("batch returns rows, so output must be 'dicts' or 'records'")
+
+        groups = {}
+        for geo in geos:
+            level, code, parent = self._batch_key(geo)
+            if code == ALL or ',' in code:
+                raise ValueError('batch takes a single code for each geography, not {!r}'.format(
+                    geo['for']))
+            groups.setdefault((level, parent), {})[code] = None
+
+        requests = []
+        for (level, parent), codes in groups.items():
+            budget = (max_url_length or self.max_url_length) - self._url_length(
+                fields, {'for': level + ':', 'in': parent}, year)
+            if budget <= 0:
+                raise ValueError('The fields alone exceed max_url_length')
+            for pack in pack_codes(list(codes), budget):
+                geo = {'for': '{}:{}'.format(level, ','.join(pack))}
+                if parent:
+                    geo['in'] = parent
+                requests.append(geo)
+        return requests
+
+    @staticmethod
+    def _batch_key(geo):
+        """
+        (level, code, parent) for a geography, with the parent clauses
+        normalized.
+        """
+        level, code = geo['for'].rsplit(':', 1)
+        parent = ' '.join('{}:{}'.format(*clause) for clause in geo_clauses(geo.get('in')))
+        return level.strip(), code.strip(), parent
+
+    def _url_length(self, fields, geo, year):
+        """
+        The length of the longest URL get would send for fields and geo.
+        """
+        lengths = []
+        for forty_nine_fields in chunks(list(list_or_str(fields)), 49):
+            _, url, params = self._query_params(forty_nine_fields + ['GEO_ID'], geo, year)
+            if not params.get('in'):
+                params.pop('in', None)
+            lengths.append(len(url) + 1 + len(urlencode(params)))
+        return max(lengths)
+
+    def _batch_rows(self, geos, requests, results):
+        found = {}
+        for geo, rows in zip(requests, results):
+            level, _, parent = self._batch_key(geo)
+            for row in rows:
+                found[(level, row[level], parent)] = row
+        return [found.get(self._batch_key(geo)) for geo in geos]
+
+    def panel(self, fields, geo, years, max_workers=None, **kwargs):
+        """
+        Like get, for each of years (e.g. range(2010, 2023)) at once.
+
+        The years are requested concurrently, up to max_workers (by
+        default, the client's max_workers) at a time, and returned as one
+        long-format result, in the order of years, with each row tagged
+        with its 'year'. Years the dataset doesn't cover are all reported
+        before any request is made.
+        """
+        years = self._panel_years(years)
+        output = kwargs.get('output', 'dicts')
+
+        results = parallel_map(
+            lambda year: tag_result(self.get(fields, geo, year=year, **kwargs), 'year', year, output),
+            years,
+            max_workers or self.max_workers)
+
+        return concat_results(results, output)
+
+    def _panel_years(self, years):
+        years = [int(year) for year in list_of_years(years)]
+
+        unsupported = [year for year in years if year not in self.years]
+        if unsupported:
+            raise UnsupportedYearException(
+                '{} is not available in {}. Available years include {}'.format(
+                    self.dataset, ', '.join(map(str, unsupported)), self.years))
+        return years
+
+    @staticmethod
+    def _geo(for_clause, parent):
+        geo = {'for': for_clause}
+        if parent:
+            geo['in'] = ' '.join('{}:{}'.format(level, code) for level, code in parent)
+        return geo
+
+    def iter_get(self, fields, geo, year=None, **kwargs):
+        """
+        Like get, but yields one dict per row while the response is still
+        streaming in, in the order the API returns them.
+
+        With up to 49 fields, memory use stays flat however many rows
+        come back. With more, the chunks before the last are fetched up
+        front and held in memory, keyed by geography, and the last chunk
+        is streamed and joined on to them. As with get, a row missing
+        from some chunks has None for their fields and is reported with
+        an UnmatchedRowsWarning; rows missing from the last chunk come
+        after the others.
+        """
+        field_chunks = list(chunks(list_or_str(fields), 49))
+
+        def index(forty_nine_fields):
+            return {geo_key(row, forty_nine_fields): row
+                    for row in self.iter_query(forty_nine_fields, geo, year, **kwargs)}
+
+        indexes = parallel_map(index, field_chunks[:-1], self.max_workers)
+        joiner = StreamJoin(field_chunks, indexes)
+        for row in self.iter_query(field_chunks[-1], geo, year, **kwargs):
+            yield joiner.join(row)
+        for row in joiner.leftovers():
+            yield row
+
+    def iter_query(self, fields, geo, year=None, chunk_size=64 * 1024, **kwargs):
+        """
+        Like query, but parses the response incrementally and yields one
+        dict per row as it arrives, in the order the API returns them.
+        """
+        if year is None:
+            year = self.default_year
+
+        fields, url, params = self._query_params(fields, geo, year)
+        resp = self._open_stream(url, params)
+        if resp is None:
+            return
+
+        try:
+            rows = iter_json_array(iter_text(resp.iter_content(chunk_size), resp.encoding))
+            try:
+                headers = next(rows)
+            except StopIteration:
+                return
+            except ValueError as ex:
+                if '<title>Invalid Key</title>' in str(ex):
+                    raise APIKeyError(' '.join(str(ex).splitlines()))
+                raise
+
+            types = self._header_types(headers, year)
+            decoder = compile_decoder(tuple(headers), tuple(types), self.null_values)
+            for d in rows:
+                yield decoder.row(d)
+        finally:
+            resp.close()
 
     @retry_on_transient_error
-    def query(self, fields, geo, year=None, sort_by_geoid=False, **kwargs):
+    def _open_stream(self, url, params):
+        resp = self._request(url, params, stream=True)
+        if resp.status_code == 200:
+            return resp
+        try:
+            self._response_data(resp)
+        finally:
+            resp.close()
+
+    def query(self, fields, geo, year=None, sort_by_geoid=False, cache=True,
+              output='dicts', **kwargs):
+        """
+        Request fields for geo. When the client has a response cache,
+        pass cache=False to bypass it or cache='refresh' to fetch a fresh
+        response and overwrite the cached one. See get for output.
+        """
+        if output not in OUTPUTS:
+            raise ValueError('output must be one of {}'.format(', '.join(OUTPUTS)))
         if year is None:
             year = self.default_year
 
         fields = list_or_str(fields)
         if sort_by_geoid:
-            if isinstance(fields, list):
-                fields += ['GEO_ID']
-            elif isinstance(fields, tuple):
-                fields += ('GEO_ID',)
+            fields = list(fields) + ['GEO_ID']
 
-        url = self.endpoint_url % (year, self.dataset)
+        with self.hooks.instrument('query', self.dataset, year, geo, fields) as event:
+            headers, data = self._fetch(fields, geo, year, cache, event=event)
+            start = time.perf_counter()
+            if sort_by_geoid:
+                data.sort(key=itemgetter(headers.index('GEO_ID')))
+                start = lap(event, 'sort', start)
+
+            types = self._header_types(headers, year)
+            start = lap(event, 'types', start)
+            result = self._decode(headers, types, data, output)
+            lap(event, 'cast', start)
+            return result
+
+    @supported_years()
+    def get_table(self, table, geo, year=None, cache=True, output='dicts', **kwargs):
+        """
+        Request every variable of table (a group such as 'B01001') for geo
+        in a single request, using the API's group() syntax, instead of
+        listing the variables and joining 49-field chunks. The rows have
+        the same shape as get's, with the table's estimates, margins and
+        annotations plus GEO_ID and NAME. The types come from the table's
+        metadata, so variables.json isn't needed.
+        """
+        if output not in OUTPUTS:
+            raise ValueError('output must be one of {}'.format(', '.join(OUTPUTS)))
+        if year is None:
+            year = self.default_year
+
+        fields = ['group({})'.format(table)]
+        with self.hooks.instrument('table', self.dataset, year, geo, fields) as event:
+            headers, data = self._fetch(fields, geo, year, cache, event=event)
+            start = time.perf_counter()
+            type_map = self._table_types(table, year)
+            types = [type_map.get(header, str) for header in headers]
+            start = lap(event, 'types', start)
+            result = self._decode(headers, types, data, output)
+            lap(event, 'cast', start)
+            return result
+
+    def _fetch(self, fields, geo, year, cache=True, event=None, **kwargs):
+        """
+        Request fields for geo and return the response's header row and
+        data rows, uncast. Fills in event, when there is one.
+
+        With a single_flight, concurrent identical requests share one
+        upstream request; each caller gets its own list of rows.
+        """
+        if self.single_flight is None:
+            return self._fetch_upstream(fields, geo, year, cache, event)
+
+        (headers, data), shared = self.single_flight.do(
+            self._flight_key(fields, geo, year, cache),
+            lambda: self._fetch_upstream(fields, geo, year, cache, event))
+        if event is not None:
+            event.coalesced = shared
+        return headers, list(data)
+
+    def _flight_key(self, fields, geo, year, cache):
+        return (self.dataset, int(year), tuple(list_or_str(fields)),
+                tuple(sorted(geo.items())), cache)
+
+    @retry_on_transient_error
+    def _fetch_upstream(self, fields, geo, year, cache=True, event=None):
+        """
+        Request fields for geo, with retries.
+        """
+        fields, url, params = self._query_params(fields, geo, year)
+
+        cache_key = self._cache_key(url, fields, geo, cache)
+        data = self._cached_data(cache_key, cache)
+        if event is not None:
+            event.attempts += 1
+            event.url = url
+            if cache_key is not None:
+                event.cache = 'miss' if data is None else 'hit'
+
+        if data is None:
+            start = time.perf_counter()
+            resp = self._request(url, params)
+            start = lap(event, 'network', start)
+            if event is not None:
+                event.status = resp.status_code
+                event.bytes += len(resp.content)
+            data = self._response_data(resp, cache_key)
+            lap(event, 'json', start)
+            if data is None:
+                return [], []
+
+        if event is not None:
+            event.rows = len(data) - 1
+        return data[0], data[1:]
+
+    def _request(self, url, params, **kwargs):
+        """
+        Send a GET through the session, within the shared rate limiter's
+        budget when there is one.
+        """
+        if self.rate_limiter is None:
+            return self.session.get(url, params=params, **kwargs)
+
+        self.rate_limiter.acquire()
+        status_code = None
+        try:
+            resp = self.session.get(url, params=params, **kwargs)
+            status_code = resp.status_code
+            return resp
+        finally:
+            self.rate_limiter.release(status_code)
+
+    def _query_params(self, fields, geo, year):
+        fields = list_or_str(fields)
+
+        url = self._endpoints(year).endpoint_url % (year, self.dataset)
 
         params = {
             'get': ",".join(fields),
@@ -188,8 +1585,25 @@ class Client(object):
         if 'in' in geo:
             params['in'] = geo['in']
 
-        resp = self.session.get(url, params=params)
+        return fields, url, params
+
+    def _cache_key(self, url, fields, geo, cache):
+        if self.response_cache is None or not cache:
+            return None
+        return self.response_cache.key(url, fields, geo)
 
+    def _cached_data(self, cache_key, cache):
+        if cache_key is None or cache == 'refresh':
+            return None
+        body = self.response_cache.get(cache_key)
+        if body is None:
+            return None
+        return json.loads(body.decode('utf-8'))
+
+    def _response_data(self, resp, cache_key=None):
+        """
+        Parse a data response, returning None when there is no content.
+        """
         if resp.status_code == 200:
             try:
                 data = resp.json()
@@ -199,42 +1613,83 @@ class Client(object):
                 else:
                     raise ex
 
-            headers = data.pop(0)
-            types = [self._field_type(header, year) for header in headers]
-            results = [{header: (cast(item) if item is not None else None)
-                        for header, cast, item
-                        in zip(headers, types, d)}
-                       for d in data]
-            if sort_by_geoid:
-                if 'GEO_ID' in fields:
-                    results = sorted(results, key=lambda x: x['GEO_ID'])
-                else:
-                    results = sorted(results, key=lambda x: x.pop('GEO_ID'))
-            return results
+            if cache_key is not None:
+                self.response_cache.put(cache_key, resp.text.encode('utf-8'))
+            return data
 
         elif resp.status_code == 204:
-            return []
+            return None
+
+        elif resp.status_code in (429, 503):
+            raise ThrottledException(resp.text, response=resp)
 
         else:
-            raise CensusException(resp.text)
+            raise CensusException(resp.text, response=resp)
 
-    @lru_cache(maxsize=1024)
-    def _field_type(self, field, year):
-        url = self.definition_url % (year, self.dataset, field)
-        resp = self.session.get(url, params={"key": self._key})
+    def _decode(self, headers, types, data, output='dicts'):
+        if output == 'dicts':
+            return compile_decoder(tuple(headers), tuple(types), self.null_values).dicts(data)
+        if output == 'records':
+            return compile_decoder(tuple(headers), tuple(types), self.null_values).records(data)
 
-        types = {"fips-for": str,
-                 "fips-in": str,
-                 "int": float_or_str,
-                 "long": float_or_str,
-                 "float": float,
-                 "string": str}
+        columns = decode_columns(headers, types, data, use_numpy=output == 'numpy',
+                                 sentinels=self.null_values)
+        return structured_array(columns) if output == 'numpy' else columns
 
-        if resp.status_code == 200:
-            predicate_type = resp.json().get("predicateType", "string")
-            return types[predicate_type]
-        else:
-            return str
+    def _endpoints(self, year):
+        """
+        Return the URL templates for year. Subclasses override this to
+        pick endpoints by year; it must not modify the client.
+        """
+        return Endpoints(self.endpoint_url, self.definitions_url,
+                         self.definition_url, self.groups_url, self.group_url)
+
+    def _types(self, year):
+        return self.field_types.get(self.dataset, year, lambda: self._variables(year))
+
+    def _table_types(self, table, year):
+        """
+        The type map for table's variables: the dataset's, if it has been
+        loaded already, otherwise one built from the table's own, much
+        smaller, metadata document.
+        """
+        types = self.field_types.peek(self.dataset, year)
+        if types is not None:
+            return types
+
+        def load():
+            url = self._endpoints(year).group_url % (year, self.dataset, table)
+            return self._metadata(url, year, 'group-' + table)['variables']
+
+        try:
+            return self.field_types.get(self._table_key(table), year, load)
+        except CensusException:
+            return {}
+
+    def _table_key(self, table):
+        return '{}/groups/{}'.format(self.dataset, table)
+
+    def _header_types(self, headers, year):
+        """
+        The cast function for each of headers, loading the type map once.
+        Columns are left as strings when the map can't be loaded.
+        """
+        try:
+            type_map = self._types(year)
+        except CensusException:
+            type_map = {}
+        return [type_map.get(header, str) for header in headers]
+
+    def _field_type(self, field, year):
+        return self._header_types([field], year)[0]
+
+    def prefetch(self, years=None):
+        """
+        Load the field types for each of years (by default, the default
+        year) in parallel, so later queries don't wait on the metadata.
+        """
+        years = list_of_years(years if years is not None else self.default_year)
+        parallel_map(self._types, years, self.max_workers)
 
     @supported_years()
     def us(self, fields, **kwargs):
@@ -307,27 +1762,10 @@ class Client(object):
 
 class ACSClient(Client):
 
-    def _switch_endpoints(self, year):
-
-        if year >= 2005:
-            self.endpoint_url = 'https://api.census.gov/data/%s/acs/%s'
-            self.definitions_url = 'https://api.census.gov/data/%s/acs/%s/variables.json'
-            self.definition_url = 'https://api.census.gov/data/%s/acs/%s/variables/%s.json'
-            self.groups_url = 'https://api.census.gov/data/%s/acs/%s/groups.json'
-        else:
-            self.endpoint_url = super(ACSClient, self).endpoint_url
-            self.definitions_url = super(ACSClient, self).definitions_url
-            self.definition_url = super(ACSClient, self).definition_url
-            self.groups_url = super(ACSClient, self).groups_url
-
-    def tables(self, *args, **kwargs):
-        self._switch_endpoints(kwargs.get('year', self.default_year))
-        return super(ACSClient, self).tables(*args, **kwargs)
-
-    def get(self, *args, **kwargs):
-        self._switch_endpoints(kwargs.get('year', self.default_year))
-
-        return super(ACSClient, self).get(*args, **kwargs)
+    def _endpoints(self, year):
+        if int(year) >= 2005:
+            return ACS_ENDPOINTS
+        return super(ACSClient, self)._endpoints(year)
 
 
 class ACS5Client(ACSClient):
@@ -395,11 +1833,8 @@ class ACS5DpClient(ACS5Client):
 
 
 class ACS5StClient(ACS5Client):
-    def _switch_endpoints(self, year):
-        self.endpoint_url = 'https://api.census.gov/data/%s/acs/%s'
-        self.definitions_url = 'https://api.census.gov/data/%s/acs/%s/variables.json'
-        self.definition_url = 'https://api.census.gov/data/%s/acs/%s/variables/%s.json'
-        self.groups_url = 'https://api.census.gov/data/%s/acs/%s/groups.json'
+    def _endpoints(self, year):
+        return ACS_ENDPOINTS
 
     dataset = 'acs5/subject'
 
@@ -455,21 +1890,8 @@ class SF1Client(Client):
 
     years = (2010,)
 
-    def _switch_endpoints(self, year):
-
-        self.endpoint_url = 'https://api.census.gov/data/%s/dec/%s'
-        self.definitions_url = 'https://api.census.gov/data/%s/dec/%s/variables.json'
-        self.definition_url = 'https://api.census.gov/data/%s/dec/%s/variables/%s.json'
-        self.groups_url = 'https://api.census.gov/data/%s/dec/%s/groups.json'
-
-    def tables(self, *args, **kwargs):
-        self._switch_endpoints(kwargs.get('year', self.default_year))
-        return super(SF1Client, self).tables(*args, **kwargs)
-
-    def get(self, *args, **kwargs):
-        self._switch_endpoints(kwargs.get('year', self.default_year))
-
-        return super(SF1Client, self).get(*args, **kwargs)
+    def _endpoints(self, year):
+        return DEC_ENDPOINTS
 
     @supported_years()
     def state_county_subdivision(self, fields, state_fips,
@@ -537,21 +1959,8 @@ class PLClient(Client):
 
     years = (2020, 2010, 2000)
 
-    def _switch_endpoints(self, year):
-
-        self.endpoint_url = 'https://api.census.gov/data/%s/dec/%s'
-        self.definitions_url = 'https://api.census.gov/data/%s/dec/%s/variables.json'
-        self.definition_url = 'https://api.census.gov/data/%s/dec/%s/variables/%s.json'
-        self.groups_url = 'https://api.census.gov/data/%s/dec/%s/groups.json'
-
-    def tables(self, *args, **kwargs):
-        self._switch_endpoints(kwargs.get('year', self.default_year))
-        return super(PLClient, self).tables(*args, **kwargs)
-
-    def get(self, *args, **kwargs):
-        self._switch_endpoints(kwargs.get('year', self.default_year))
-
-        return super(PLClient, self).get(*args, **kwargs)
+    def _endpoints(self, year):
+        return DEC_ENDPOINTS
 
     @supported_years()
     def state_county_subdivision(self, fields, state_fips,
@@ -582,35 +1991,133 @@ class PLClient(Client):
 
 
 class Census(object):
+    """
+    The dataset clients, sharing one session and one set of caches and
+    policies. Each client (and the session, when one isn't passed in) is
+    created the first time it is used.
+
+    Without a session, the clients share a census.transport transport:
+    transport is 'requests' (the default), 'httpx' or 'http2'. It keeps
+    up to pool_size connections open, by default enough for max_workers
+    threads, and gives up on requests after timeout seconds.
+    """
 
     ALL = ALL
 
-    def __init__(self, key, year=None, session=None):
+    DATASETS = {
+        'acs5': ACS5Client,
+        'acs3': ACS3Client,
+        'acs1': ACS1Client,
+        'acs5st': ACS5StClient,
+        'acs5dp': ACS5DpClient,
+        'acs3dp': ACS3DpClient,
+        'acs1dp': ACS1DpClient,
+        'sf1': SF1Client,
+        'pl': PLClient,
+        '_acs': ACS5Client,  # deprecated
+    }
+
+    def __init__(self, key, year=None, session=None, max_workers=8,
+                 metadata_cache=None, response_cache=None, rate_limiter=None,
+                 retry_policy=None, null_values=None, hooks=None, single_flight=True,
+                 transport='requests', pool_size=None, timeout=None):
         if key == "" or key is None:
             raise ValueError(
                 "As of May 12, 2026, all requests to the US Census API require an API key. "
                 "You may acquire one at https://api.census.gov/data/key_signup.html"
             )
 
-        if not session:
-            session = new_session()
-
-        self.session = session
-        self.session.headers.update({
-            'User-Agent': ('python-census/{} '.format(__version__) +
-                           'github.com/datamade/census')
-        })
-
-        self._acs = ACS5Client(key, year, session)  # deprecated
-        self.acs5 = ACS5Client(key, year, session)
-        self.acs3 = ACS3Client(key, year, session)
-        self.acs1 = ACS1Client(key, year, session)
-        self.acs5st = ACS5StClient(key, year, session)
-        self.acs5dp = ACS5DpClient(key, year, session)
-        self.acs3dp = ACS3DpClient(key, year, session)
-        self.acs1dp = ACS1DpClient(key, year, session)
-        self.sf1 = SF1Client(key, year, session)
-        self.pl = PLClient(key, year, session)
+        if session is None and transport not in TRANSPORTS:
+            raise ValueError('transport must be one of {}'.format(', '.join(TRANSPORTS)))
+
+        self._key = key
+        self._year = year
+        self._session = session or None
+        self._session_ready = False
+        self._lock = threading.Lock()
+        self._transport_options = {
+            'name': transport,
+            'pool_size': pool_size or max(10, max_workers),
+            'timeout': timeout,
+        }
+
+        self.max_workers = max_workers
+        self.hooks = hooks if hooks is not None else Hooks()
+        self._client_kwargs = {
+            'max_workers': max_workers,
+            'field_types': FieldTypes(),
+            'metadata_cache': metadata_cache,
+            'response_cache': response_cache,
+            'rate_limiter': rate_limiter,
+            'retry_policy': retry_policy or RetryPolicy(),
+            'null_values': null_values,
+            'hooks': self.hooks,
+            'single_flight': SingleFlight() if single_flight is True else single_flight or None,
+        }
+
+    @property
+    def session(self):
+        with self._lock:
+            if not self._session_ready:
+                if self._session is None:
+                    from census.transport import new_transport
+                    self._session = new_transport(**self._transport_options)
+                self._session.headers.update({
+                    'User-Agent': ('python-census/{} '.format(package_version()) +
+                                   'github.com/datamade/census')
+                })
+                self._session_ready = True
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        # Clients that have been built already switch to the new session.
+        with self._lock:
+            self._session = session
+            self._session_ready = False
+            clients = [client for name, client in vars(self).items() if name in self.DATASETS]
+        session = self.session
+        for client in clients:
+            client.session = session
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set yet, i.e. clients
+        # that haven't been used.
+        client_class = self.DATASETS.get(name)
+        if client_class is None:
+            raise AttributeError('{!r} object has no attribute {!r}'.format(
+                type(self).__name__, name))
+
+        session = self.session
+        with self._lock:
+            client = self.__dict__.get(name)
+            if client is None:
+                client = client_class(self._key, self._year, session, **self._client_kwargs)
+                self.__dict__[name] = client
+        return client
+
+    def close(self):
+        """
+        Close the session's connections.
+        """
+        if self._session is not None:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def prefetch(self, datasets, years=None):
+        """
+        Warm the field types shared by this object's clients for each of
+        datasets (attribute names such as 'acs5') and years, fetching
+        the variables.json documents in parallel. When years is omitted,
+        each dataset's default year is used.
+        """
+        work = prefetch_work(self, datasets, years)
+        parallel_map(lambda job: job[0]._types(job[1]), work, self.max_workers)
 
     @property
     def acs(self):
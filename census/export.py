@@ -0,0 +1,235 @@
+"""
+Stream query results to CSV, NDJSON or Parquet files.
+
+    from census import Census
+    from census.export import export
+
+    c = Census("MY_API_KEY")
+    export(c.acs5, 'counties.parquet', table='B01001',
+           geo={'for': 'county:*', 'in': 'state:*'}, year=2022)
+
+Rows are written in batches as the responses arrive, so memory use is
+bounded by the batch size and the number of requests in flight rather
+than by the size of the extract. Writing Parquet needs pyarrow
+(``pip install census[parquet]``).
+"""
+import csv
+import io
+import json
+import os
+import sys
+
+from census.core import ALL, float_or_str, geo_clauses, imap_unordered, list_or_str
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.parquet': 'parquet',
+}
+
+
+def iter_batches(client, geo, fields=None, table=None, year=None, batch_size=5000,
+                 max_workers=None):
+    """
+    Yield the rows for fields (or every variable of table) and geo as
+    lists of at most batch_size dicts.
+
+    When a level of geo['in'] is a wildcard, the parent geographies are
+    fetched concurrently and each one's rows are yielded as soon as they
+    arrive, in no particular order. Otherwise a request for fields is
+    streamed, and a table is fetched in one request. Either way, rows for
+    fields come from iter_get, so they have the same columns whatever
+    the geography.
+    """
+    if (fields is None) == (table is None):
+        raise ValueError('Pass either fields or table')
+    if year is None:
+        year = client.default_year
+
+    if table is not None:
+        def fetch(child):
+            return client.get_table(table, child, year=year)
+    else:
+        fields = list_or_str(fields)
+
+        def fetch(child):
+            return list(client.iter_get(fields, child, year))
+
+    if any(code == ALL for _, code in geo_clauses(geo.get('in'))):
+        max_workers = max_workers or client.max_workers
+        children = client._fan_out_geos(geo, year, max_workers)
+        for rows in imap_unordered(fetch, children, max_workers):
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+    elif table is not None:
+        rows = fetch(geo)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+    else:
+        batch = []
+        for row in client.iter_get(fields, geo, year):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def export(client, output, geo, fields=None, table=None, year=None, format=None,
+           batch_size=5000, max_workers=None):
+    """
+    Write the rows for fields (or every variable of table) and geo to
+    output, a path or a file object, and return the number of rows
+    written. format is 'csv', 'ndjson' or 'parquet'; by default it is
+    taken from the path's extension. See iter_batches for the rest.
+    """
+    if year is None:
+        year = client.default_year
+    if table is not None:
+        types = client._table_types(table, year)
+    elif fields is not None:
+        fields = list_or_str(fields)
+        types = dict(zip(fields, client._header_types(fields, year)))
+    else:
+        types = None
+
+    writer = open_writer(output, format, types)
+    count = 0
+    try:
+        for batch in iter_batches(client, geo, fields, table, year, batch_size, max_workers):
+            writer.write(batch)
+            count += len(batch)
+    finally:
+        writer.close()
+    return count
+
+
+def open_writer(output, format=None, types=None):
+    """
+    Return a writer for output, a path (or '-' for standard output,
+    as CSV unless format says otherwise) or a file object. types maps
+    columns to the client's cast functions; Parquet files take their
+    schema from it.
+    """
+    if format is None and output == '-':
+        format = 'csv'
+    if format is None:
+        if not isinstance(output, str):
+            raise ValueError('format is required when output is not a path')
+        format = EXTENSIONS.get(os.path.splitext(output)[1].lower())
+        if format is None:
+            raise ValueError('Cannot tell the format of {!r}; pass format'.format(output))
+    if format not in FORMATS:
+        raise ValueError('format must be one of {}'.format(', '.join(FORMATS)))
+
+    if format == 'parquet':
+        return ParquetWriter(sys.stdout.buffer if output == '-' else output, types)
+    writer_class = CSVWriter if format == 'csv' else NDJSONWriter
+    if output == '-':
+        return writer_class(sys.stdout, close=False)
+    if isinstance(output, str):
+        return writer_class(open(output, 'w', newline='', encoding='utf-8'))
+    return writer_class(output, close=False)
+
+
+class CSVWriter(object):
+    """
+    Writes batches of rows as CSV, with a header row taken from the
+    first row written.
+    """
+
+    def __init__(self, file, close=True):
+        self.file = file
+        self._close = close
+        self._writer = None
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self._writer is None:
+            self._writer = csv.DictWriter(self.file, fieldnames=list(rows[0]))
+            self._writer.writeheader()
+        self._writer.writerows(rows)
+
+    def close(self):
+        if self._close:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class NDJSONWriter(object):
+    """
+    Writes batches of rows as newline-delimited JSON, one object per row.
+    """
+
+    def __init__(self, file, close=True):
+        self.file = file
+        self._close = close
+
+    def write(self, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            json.dump(dict(row), buffer, separators=(',', ':'))
+            buffer.write('\n')
+        self.file.write(buffer.getvalue())
+
+    def close(self):
+        if self._close:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class ParquetWriter(object):
+    """
+    Writes each batch of rows as a Parquet row group. The schema comes
+    from types, a map of columns to the client's cast functions: numeric
+    columns are doubles and the rest, including the geography columns,
+    strings. Values that don't fit their column's type are written as
+    nulls.
+    """
+
+    def __init__(self, output, types=None):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        self.output = output
+        self.types = types or {}
+        self._writer = None
+
+    def schema(self, columns):
+        pyarrow = self._pyarrow
+        return pyarrow.schema([
+            (column, pyarrow.float64() if self.types.get(column) in (float, float_or_str)
+             else pyarrow.string())
+            for column in columns])
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self._writer is None:
+            self._writer = self._parquet.ParquetWriter(self.output, self.schema(list(rows[0])))
+
+        schema = self._writer.schema
+        columns = {}
+        for field in schema:
+            values = [row.get(field.name) for row in rows]
+            if field.type == self._pyarrow.float64():
+                columns[field.name] = [
+                    value if isinstance(value, (int, float)) else None for value in values]
+            else:
+                columns[field.name] = [
+                    value if value is None or isinstance(value, str) else str(value)
+                    for value in values]
+        self._writer.write_table(self._pyarrow.Table.from_pydict(columns, schema=schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
@@ -0,0 +1,81 @@
+import threading
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key into one: the first
+    caller runs the function, and callers arriving while it runs wait for
+    it and get the same result (or exception). Nothing is kept once the
+    call finishes, so later calls run the function again.
+
+    do returns (result, shared), where shared is True for the callers
+    that waited on another caller's run. The shared attribute counts
+    those calls.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AsyncSingleFlight(object):
+    """
+    The asyncio counterpart of SingleFlight. The shared call runs as a
+    task, so it carries on for the other callers if the first one is
+    cancelled.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+
+    async def do(self, key, func):
+        import asyncio
+
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
@@ -0,0 +1,124 @@
+import time
+import warnings
+from contextlib import contextmanager
+
+
+class RequestEvent(object):
+    """
+    What happened during one call to the Census API.
+
+    kind is 'query' for a query (or a get of at most 49 fields), 'chunk'
+    for each request of a wider get, 'get' for the wider get as a whole
+    and 'table' for a get_table. phases maps the name of each phase to
+    the seconds spent in it:
+
+    - network: sending the request and reading the response, including
+      any wait for the rate limiter
+    - json: parsing the response body
+    - fetch: waiting for all of the chunks of a get
+    - join: joining the chunks of a get
+    - sort: sorting by GEO_ID, for a query with sort_by_geoid
+    - types: looking up the type of each column
+    - cast: casting the values and building the result
+
+    A phase that was repeated, e.g. because the request was retried,
+    holds the total time. cache is 'hit' or 'miss' when the client has a
+    response cache, and None otherwise. coalesced is True when the
+    request was answered by an identical request already in flight, in
+    which case url, status, bytes and the request phases are left unset.
+    error is the exception the call raised, if any.
+    """
+
+    def __init__(self, kind, dataset, year, geo, fields):
+        self.kind = kind
+        self.dataset = dataset
+        self.year = year
+        self.geo = geo
+        self.geo_level = geo.get('for', '').split(':')[0]
+        self.fields = fields
+        self.url = None
+        self.status = None
+        self.bytes = 0
+        self.rows = None
+        self.attempts = 0
+        self.cache = None
+        self.coalesced = False
+        self.phases = {}
+        self.duration = None
+        self.error = None
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    def __repr__(self):
+        return '<RequestEvent {} {} {} {} fields={} status={} {:.3f}s>'.format(
+            self.kind, self.dataset, self.year, self.geo_level, self.fields,
+            self.status, self.duration or 0)
+
+
+def lap(event, phase, start):
+    """
+    Add the time since start to event's phase, when there is an event,
+    and return the current time.
+    """
+    now = time.perf_counter()
+    if event is not None:
+        event.phases[phase] = event.phases.get(phase, 0) + now - start
+    return now
+
+
+class Hooks(object):
+    """
+    Callbacks that receive a RequestEvent after each call to the API.
+    Census shares one Hooks between all of its clients.
+
+    Nothing is measured while there are no subscribers. Callbacks run on
+    the thread that made the call; an exception raised by one is turned
+    into a warning so that it cannot break the call.
+    """
+
+    def __init__(self):
+        self._subscribers = ()
+
+    def subscribe(self, callback):
+        """
+        Call callback(event) after every call. Returns callback, so that
+        this can be used as a decorator.
+        """
+        self._subscribers = self._subscribers + (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers = tuple(s for s in self._subscribers if s != callback)
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+    def emit(self, event):
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                warnings.warn('Request hook {!r} failed: {!r}'.format(callback, e), RuntimeWarning)
+
+    @contextmanager
+    def instrument(self, kind, dataset, year, geo, fields):
+        """
+        Yield a RequestEvent to fill in, emitting it when the block exits,
+        or None when there are no subscribers.
+        """
+        if not self._subscribers:
+            yield None
+            return
+
+        event = RequestEvent(kind, dataset, year, geo, len(fields))
+        start = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.duration = time.perf_counter() - start
+            self.emit(event)
@@ -0,0 +1,239 @@
+"""
+Bulk extractions that survive failures and restarts.
+
+A Job splits an extraction into work units, one per geography and chunk
+of at most 49 fields, with any wildcard parents in geo['in'] expanded
+once, up front. The manifest and each finished unit's response are
+recorded in a SQLite checkpoint file, so running the same job again,
+after an error or in a new process, only requests the units that are
+still missing::
+
+    from census import Census
+    from census.jobs import Job
+
+    c = Census("MY_API_KEY")
+    with Job(c.acs5, fields, {'for': 'tract:*', 'in': 'state:* county:*'},
+             year=2022, store='tracts.sqlite') as job:
+        job.run()
+        rows = job.results()
+
+Without a store, jobs are kept in jobs.sqlite in the per-user cache
+directory (see census.cache.default_cache_dir).
+"""
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+
+from census.cache import default_cache_dir
+from census.core import (
+    ALL, chunks, concat_results, geo_clauses, imap_unordered, join_tables, list_or_str)
+
+
+class CheckpointStore(object):
+    """
+    A SQLite file holding the manifest of each job and the responses of
+    its finished units, gzip-compressed. One file can hold any number of
+    jobs. It is safe to use from the threads of one process. By default
+    the file is jobs.sqlite in the per-user cache directory.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(default_cache_dir(), exist_ok=True)
+            path = os.path.join(default_cache_dir(), 'jobs.sqlite')
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job TEXT PRIMARY KEY, spec TEXT NOT NULL, created REAL NOT NULL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS units ('
+                'job TEXT NOT NULL, unit INTEGER NOT NULL, part INTEGER NOT NULL, '
+                'geo TEXT NOT NULL, fields TEXT NOT NULL, result BLOB, '
+                'PRIMARY KEY (job, unit))')
+
+    def units(self, job):
+        """
+        Return the job's units as (unit, part, geo, fields, done) tuples,
+        or None if the job has not been planned.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT unit, part, geo, fields, result IS NOT NULL FROM units '
+                'WHERE job = ? ORDER BY unit', (job,)).fetchall()
+            known = rows or self._db.execute(
+                'SELECT 1 FROM jobs WHERE job = ?', (job,)).fetchone()
+        if not known:
+            return None
+        return [(unit, part, json.loads(geo), json.loads(fields), bool(done))
+                for unit, part, geo, fields, done in rows]
+
+    def create(self, job, spec, units):
+        """
+        Record a job's spec and its units, as (part, geo, fields) tuples,
+        in one transaction.
+        """
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO jobs VALUES (?, ?, ?)',
+                             (job, json.dumps(spec), time.time()))
+            self._db.executemany(
+                'INSERT INTO units (job, unit, part, geo, fields) VALUES (?, ?, ?, ?, ?)',
+                ((job, unit, part, json.dumps(geo), json.dumps(fields))
+                 for unit, (part, geo, fields) in enumerate(units)))
+
+    def finish(self, job, unit, headers, data):
+        """
+        Record a unit's response, committing it at once.
+        """
+        body = gzip.compress(json.dumps([headers, data]).encode('utf-8'))
+        with self._lock, self._db:
+            self._db.execute('UPDATE units SET result = ? WHERE job = ? AND unit = ?',
+                             (body, job, unit))
+
+    def result(self, job, unit):
+        """
+        Return the (headers, rows) response recorded for a unit.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT result FROM units WHERE job = ? AND unit = ?',
+                                   (job, unit)).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError((job, unit))
+        headers, data = json.loads(gzip.decompress(row[0]).decode('utf-8'))
+        return headers, data
+
+    def delete(self, job):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM units WHERE job = ?', (job,))
+            self._db.execute('DELETE FROM jobs WHERE job = ?', (job,))
+
+    def close(self):
+        self._db.close()
+
+
+class Job(object):
+    """
+    Request fields for geo from client, one work unit at a time, keeping
+    track of finished units in store (a path or a CheckpointStore).
+
+    A job is identified by its dataset, year, fields and geography, so
+    constructing the same Job again picks up where the last one left
+    off. run raises the first error it meets; the units that finished
+    before it stay recorded.
+
+    Use a Job as a context manager, or call close() when done, to close
+    the store it opened. A CheckpointStore that is passed in is left
+    open for its owner to close.
+    """
+
+    def __init__(self, client, fields, geo, year=None, store=None):
+        self.client = client
+        self.fields = list(list_or_str(fields))
+        self.geo = dict(geo)
+        self.year = int(year if year is not None else client.default_year)
+        self._owns_store = not isinstance(store, CheckpointStore)
+        self.store = CheckpointStore(store) if self._owns_store else store
+        self.spec = {'dataset': client.dataset, 'year': self.year,
+                     'fields': self.fields, 'geo': self.geo}
+        self.id = hashlib.sha256(json.dumps(self.spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def units(self):
+        """
+        The job's units as (unit, part, geo, fields, done) tuples, where
+        part numbers the geography. The first call for a new job expands
+        any wildcards in geo['in'] and records the manifest.
+        """
+        units = self.store.units(self.id)
+        if units is None:
+            self.store.create(self.id, self.spec, self._plan())
+            units = self.store.units(self.id)
+        return units
+
+    def _plan(self):
+        if any(code == ALL for _, code in geo_clauses(self.geo.get('in'))):
+            geos = self.client._fan_out_geos(self.geo, self.year, self.client.max_workers)
+        else:
+            geos = [self.geo]
+
+        field_chunks = [list(chunk) for chunk in chunks(self.fields, 49)]
+        if len(field_chunks) > 1 and self.year > 2009:
+            field_chunks = [chunk + ['GEO_ID'] for chunk in field_chunks]
+
+        return [(part, geo, chunk)
+                for part, geo in enumerate(geos)
+                for chunk in field_chunks]
+
+    def progress(self):
+        """
+        Return (finished units, total units).
+        """
+        units = self.units()
+        return sum(1 for unit in units if unit[4]), len(units)
+
+    def run(self, max_workers=None):
+        """
+        Request every unfinished unit, up to max_workers (by default, the
+        client's) at a time, and return the number requested.
+        """
+        pending = [unit for unit in self.units() if not unit[4]]
+        client = self.client
+
+        def fetch(unit):
+            number, _, geo, fields, _ = unit
+            with client.hooks.instrument('chunk', client.dataset, self.year, geo, fields) as event:
+                headers, data = client._fetch(fields, geo, self.year, event=event)
+            self.store.finish(self.id, number, headers, data)
+
+        for _ in imap_unordered(fetch, pending, max_workers or client.max_workers):
+            pass
+        return len(pending)
+
+    def iter_results(self, output='dicts'):
+        """
+        Yield the result for each geography, in manifest order, from the
+        recorded responses. The job must have finished.
+        """
+        units = self.units()
+        unfinished = sum(1 for unit in units if not unit[4])
+        if unfinished:
+            raise RuntimeError('{} of {} units have not finished; call run()'.format(
+                unfinished, len(units)))
+
+        for _, part_units in groupby(units, key=itemgetter(1)):
+            part_units = list(part_units)
+            tables = [self.store.result(self.id, unit[0]) for unit in part_units]
+            field_chunks = [unit[3] for unit in part_units]
+
+            if len(tables) == 1:
+                headers, data = tables[0]
+            else:
+                headers, data = join_tables(tables, field_chunks)
+            if not headers:
+                continue
+            types = self.client._header_types(headers, self.year)
+            yield self.client._decode(headers, types, data, output)
+
+    def results(self, output='dicts'):
+        """
+        The rows of every geography, as one result of the given output.
+        """
+        return concat_results(self.iter_results(output), output)
+
+    def close(self):
+        if self._owns_store:
+            self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,254 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from operator import itemgetter
+
+from census.aio import AsyncCensus
+from census.cache import MetadataCache
+from census.core import CensusException, UnsupportedYearException
+from census.tests.test_census import FakeSession
+from census.throttle import AsyncRateLimiter, RateLimiter
+
+
+class FakeAsyncSession(object):
+
+    def __init__(self, session):
+        self.sync = session
+        self.headers = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get(self, url, params=None, headers=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            return self.sync.get(url, params=params, headers=headers)
+        finally:
+            self.in_flight -= 1
+
+    def build_request(self, method, url, params=None):
+        return url, params
+
+    async def send(self, request, stream=False):
+        url, params = request
+        return FakeStream(await self.get(url, params=params))
+
+    async def aclose(self):
+        pass
+
+
+class FakeStream(object):
+    """
+    A streamed httpx.Response, read in chunks of a few bytes.
+    """
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.status_code = resp.status_code
+        self.encoding = resp.encoding
+        self.closed = False
+
+    @property
+    def text(self):
+        return self.resp.text
+
+    async def aiter_bytes(self, chunk_size=None):
+        for chunk in self.resp.iter_content(7):
+            yield chunk
+
+    async def aread(self):
+        return self.resp.content
+
+    async def aclose(self):
+        self.closed = True
+
+
+class TestAsyncCensus(unittest.TestCase):
+
+    fields = ['B01001_{:03d}E'.format(i) for i in range(1, 121)]
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_geography_helpers_and_chunks(self):
+        session = FakeAsyncSession(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session, max_concurrency=2) as c:
+                counties = await asyncio.gather(*(
+                    c.acs5.state_county(self.fields, '24', county)
+                    for county in ('001', '003', '005')))
+                states = await c.acs5.state('NAME', '24', year=2020)
+            return counties, states
+
+        counties, states = self.run_async(main())
+        self.assertEqual(len(counties), 3)
+        for rows, county in zip(counties, ('001', '003', '005')):
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(rows[0]['GEO_ID'], '0400000US24' + county)
+            self.assertEqual(rows[0][self.fields[0]], float('24{}.11'.format(county)))
+        self.assertEqual(states, [{'NAME': '24.4', 'state': '24'}])
+        self.assertEqual(session.max_in_flight, 2)
+
+        metadata_calls = [url for url, params in session.sync.calls if 'get' not in params]
+        self.assertEqual(len(metadata_calls), 2)
+
+    def test_single_flight(self):
+        session = FakeAsyncSession(FakeSession())
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                return await asyncio.gather(*(c.acs5.state('NAME', '06') for _ in range(5)))
+
+        results = self.run_async(main())
+        self.assertEqual(results, [[{'NAME': '6.4', 'state': '06'}]] * 5)
+        data_calls = [params for _, params in session.sync.calls if 'get' in params]
+        self.assertEqual(len(data_calls), 1)
+
+    def test_panel(self):
+        session = FakeAsyncSession(FakeSession(variables={'NAME': 'string'}))
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                return await c.acs5.panel('NAME', {'for': 'state:06'}, range(2018, 2021))
+
+        self.assertEqual(self.run_async(main()),
+                         [{'NAME': '6.4', 'state': '06', 'year': year} for year in range(2018, 2021)])
+
+    def test_batch(self):
+        session = FakeAsyncSession(FakeSession(variables={'NAME': 'string'}))
+        geos = [{'for': 'county:{:03d}'.format(i), 'in': 'state:06'} for i in (5, 1, 3)]
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                return await c.acs5.batch('NAME', geos)
+
+        rows = self.run_async(main())
+        self.assertEqual([row['county'] for row in rows], ['005', '001', '003'])
+        data_calls = [params for _, params in session.sync.calls if 'get' in params]
+        self.assertEqual(len(data_calls), 1)
+
+    def test_get_table(self):
+        session = FakeAsyncSession(FakeSession())
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                return await c.acs5.get_table('B01001', {'for': 'state:06'})
+
+        self.assertEqual(self.run_async(main()), [{
+            'GEO_ID': '0400000US06', 'NAME': '6.4', 'B01001_001E': 6.11,
+            'B01001_001EA': '6.12', 'B01001_001M': 6.11, 'state': '06'}])
+        self.assertEqual([params.get('get') for _, params in session.sync.calls],
+                         ['group(B01001)', None])
+
+    def test_fan_out(self):
+        session = FakeAsyncSession(FakeSession())
+        geo = {'for': 'block group:*', 'in': 'state:* county:* tract:000100'}
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                rows = await c.acs5.fan_out(self.fields, geo)
+                parts = [part async for part in c.acs5.iter_fan_out(self.fields, geo)]
+            return rows, parts
+
+        rows, parts = self.run_async(main())
+        geographies = FakeSession.geographies
+        self.assertEqual(len(rows), len(geographies['state']) * len(geographies['county']) * 2)
+        self.assertEqual(
+            sorted((row['state'], row['county'], row['tract'], row['block group'])
+                   for row in rows[:2]),
+            [('01', '001', '000100', '1'), ('01', '001', '000100', '2')])
+        self.assertEqual(len(parts), len(geographies['state']) * len(geographies['county']))
+        self.assertEqual(sorted(row['GEO_ID'] for part in parts for row in part),
+                         sorted(row['GEO_ID'] for row in rows))
+
+    def test_iter_get(self):
+        session = FakeAsyncSession(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        geo = {'for': 'county:*', 'in': 'state:06'}
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                rows = await c.acs5.get(self.fields, geo)
+                streamed = [row async for row in c.acs5.iter_get(self.fields, geo)]
+                narrow = [row async for row in c.acs5.iter_query('NAME', geo)]
+            return rows, streamed, narrow
+
+        rows, streamed, narrow = self.run_async(main())
+        key = itemgetter('county')
+        self.assertEqual(sorted(streamed, key=key),
+                         [{k: v for k, v in row.items() if k != 'GEO_ID'}
+                          for row in sorted(rows, key=key)])
+        self.assertEqual(sorted(narrow, key=key), [
+            {'NAME': '6001.4', 'state': '06', 'county': '001'},
+            {'NAME': '6003.4', 'state': '06', 'county': '003'}])
+
+    def test_rate_limiter(self):
+        session = FakeAsyncSession(FakeSession())
+        limiter = AsyncRateLimiter(max_concurrency=2, initial_concurrency=2)
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session, rate_limiter=limiter) as c:
+                return await asyncio.gather(*(
+                    client.state('NAME', '06') for client in (c.acs5, c.acs1, c.pl) * 3))
+
+        self.assertEqual(len(self.run_async(main())), 9)
+        self.assertGreater(len(session.sync.calls), 2)
+        self.assertEqual(session.max_in_flight, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+        with self.assertRaises(TypeError):
+            AsyncCensus('fake-key', session=session, rate_limiter=RateLimiter())
+
+    def test_prefetch_years(self):
+        session = FakeAsyncSession(FakeSession())
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                await c.acs5.prefetch(range(2018, 2021))
+                await c.prefetch(['acs1'], range(2018, 2020))
+
+        self.run_async(main())
+        self.assertEqual(len(session.sync.calls), 5)
+
+    def test_metadata_cache(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        async def fields(session):
+            async with AsyncCensus('fake-key', session=session,
+                                   metadata_cache=MetadataCache(path)) as c:
+                return await c.acs5.fields()
+
+        first = FakeAsyncSession(FakeSession(variables={'NAME': 'string'}))
+        second = FakeAsyncSession(FakeSession())
+        self.assertEqual(self.run_async(fields(first)), self.run_async(fields(second)))
+        self.assertEqual(len(first.sync.calls), 1)
+        self.assertEqual(second.sync.calls, [])
+
+    def test_errors(self):
+        session = FakeAsyncSession(FakeSession(fail_on=self.fields[-1]))
+        c = AsyncCensus('fake-key', session=session)
+
+        with self.assertRaises(CensusException):
+            self.run_async(c.acs5.us(self.fields))
+        with self.assertRaises(UnsupportedYearException):
+            c.acs5.us('NAME', year=2001)
+        with self.assertRaises(UnsupportedYearException):
+            c.acs5.get_table('B01001', {'for': 'state:06'}, 2001)
+        with self.assertRaises(UnsupportedYearException):
+            self.run_async(c.prefetch(['acs5'], [2001]))
+
+    def test_field_type(self):
+        session = FakeAsyncSession(FakeSession(variables={'B01001_001E': 'int'}))
+
+        async def main():
+            async with AsyncCensus('fake-key', session=session) as c:
+                return await c.acs5._field_type('B01001_001E', 2024)
+
+        self.assertEqual(self.run_async(main()).__name__, 'float_or_str')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from census.cache import MetadataCache, ResponseCache
+from census.core import Census
+from census.tests.test_census import FakeSession
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def census(self, session, **kwargs):
+        return Census('fake-key', session=session,
+                      metadata_cache=MetadataCache(self.path, **kwargs))
+
+    def test_shared_across_instances(self):
+        first = FakeSession(variables={'B01001_001E': 'int'})
+        self.census(first).acs5.fields()
+        self.census(first).acs5.tables()
+        self.assertEqual(len(first.calls), 2)
+
+        second = FakeSession()
+        census = self.census(second)
+        self.assertEqual(census.acs5.fields(), {
+            'B01001_001E': {'predicateType': 'int', 'concept': 'CONCEPT',
+                            'label': 'B01001_001E'}})
+        self.assertEqual(census.acs5.tables(), [])
+        self.assertEqual(census.acs5._field_type('B01001_001E', 2024).__name__, 'float_or_str')
+        self.assertEqual(second.calls, [])
+
+    def test_revalidates_stale_entries(self):
+        session = FakeSession()
+        census = self.census(session, ttl=0, background=False)
+        census.acs5.tables()
+        self.assertEqual(census.acs5.tables(), [])
+        self.assertEqual(len(session.calls), 2)
+        self.assertEqual(session.not_modified, 1)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    fields = ['B01001_{:03d}E'.format(i) for i in range(1, 41)]
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_hits_misses_and_flags(self):
+        cache = ResponseCache(self.path)
+        session = FakeSession()
+        census = Census('fake-key', session=session, response_cache=cache)
+
+        first = census.acs5.get(self.fields, {'for': 'state:*'})
+        second = census.acs5.get(list(reversed(self.fields)), {'for': 'state:*'})
+        self.assertEqual(first, second)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+
+        data_calls = len(session.calls)
+        census.acs5.get(self.fields, {'for': 'state:*'}, cache=False)
+        census.acs5.get(self.fields, {'for': 'state:*'}, cache='refresh')
+        self.assertEqual(len(session.calls), data_calls + 2)
+        self.assertEqual(cache.hits, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(self.path, max_bytes=150)
+        a, b, c = os.urandom(40), os.urandom(40), os.urandom(40)
+        cache.put('a', a)
+        cache.put('b', b)
+        cache.get('a')
+        cache.put('c', c)
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), a)
+        self.assertEqual(ResponseCache(self.path).stats()['entries'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
 import os
+import re
+import threading
 import time
 import unittest
+from operator import itemgetter
+
+import requests
 
 from census.core import (
-    Census, Client, UnsupportedYearException)
+    ACS_ANNOTATIONS, Census, Client, CensusException, RetryPolicy,
+    UnmatchedRowsWarning, UnsupportedYearException, compile_decoder,
+    decode_columns, float_or_str, iter_json_array, join_tables)
 
 KEY = os.environ.get('CENSUS_KEY', '')
 
@@ -385,6 +393,931 @@ class TestEndpoints(CensusTestCase):
         assert result_2010 != result_2000
 
 
+class FakeResponse(object):
+
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(body) if not isinstance(body, str) else body
+        self.content = self.text.encode('utf-8')
+        self.headers = headers or {}
+
+    encoding = None
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        content = self.text.encode('utf-8')
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    """
+    A stand-in for requests.Session that answers like api.census.gov
+    for every state, without touching the network.
+    """
+
+    states = ('01', '02', '04', '05', '06')
+    geographies = {
+        'state': states,
+        'county': ('001', '003'),
+        'tract': ('000100', '000200'),
+        'block group': ('1', '2'),
+    }
+    etag = '"v1"'
+    groups = {
+        'B01001': {'GEO_ID': 'string', 'NAME': 'string', 'B01001_001E': 'int',
+                   'B01001_001EA': 'string', 'B01001_001M': 'int'},
+    }
+
+    def __init__(self, variables=None, delay=0, fail_on=None):
+        self.variables = variables or {}
+        self.delay = delay
+        self.fail_on = fail_on
+        self.headers = {}
+        self.calls = []
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        pass
+
+    def get(self, url, params=None, **kwargs):
+        params = params or {}
+        with self._lock:
+            self.calls.append((url, params))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if (kwargs.get('headers') or {}).get('If-None-Match') == self.etag:
+                self.not_modified += 1
+                return FakeResponse(304, '')
+            return self.respond(url, params)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def respond(self, url, params):
+        if url.endswith('/variables.json'):
+            variables = {name: {'predicateType': predicate_type,
+                                'concept': 'CONCEPT', 'label': name}
+                         for name, predicate_type in self.variables.items()}
+            return FakeResponse(200, {'variables': variables}, {'ETag': self.etag})
+        if url.endswith('/groups.json'):
+            return FakeResponse(200, {'groups': []}, {'ETag': self.etag})
+        match = re.search(r'/groups/(\w+)\.json$', url)
+        if match:
+            variables = {name: {'predicateType': predicate_type, 'label': name}
+                         for name, predicate_type in self.groups[match.group(1)].items()}
+            return FakeResponse(200, {'variables': variables}, {'ETag': self.etag})
+
+        fields = []
+        for field in params['get'].split(','):
+            group = re.match(r'group\((\w+)\)$', field)
+            fields += sorted(self.groups[group.group(1)]) if group else [field]
+        if self.fail_on and self.fail_on in fields:
+            return FakeResponse(400, 'error: unknown variable {}'.format(self.fail_on))
+
+        level, code = params['for'].split(':')
+        parents = re.findall(r'\s*(.+?):(\S+)', params.get('in', ''))
+        if any(parent_code == '*' for _, parent_code in parents):
+            return FakeResponse(400, 'error: wildcard not allowed for "in"')
+
+        codes = self.geographies.get(level, ('1',)) if code == '*' else code.split(',')
+        parent_codes = [parent_code for _, parent_code in parents]
+        rows = [fields + [parent for parent, _ in parents] + [level]]
+        # Answer the chunks of a wide get in different orders to exercise
+        # the merge, choosing from the request so that threads don't matter.
+        number = int(re.sub(r'\D', '', fields[0]) or 1)
+        for code in sorted(codes, reverse=number % 2 == 0):
+            geoid = ''.join(parent_codes) + code
+            rows.append([self.value(field, geoid) for field in fields] + parent_codes + [code])
+        return FakeResponse(200, rows)
+
+    @staticmethod
+    def value(field, geoid):
+        if field == 'GEO_ID':
+            return '0400000US' + geoid
+        return '{}.{}'.format(int(geoid), len(field))
+
+
+class TestOffline(unittest.TestCase):
+
+    fields = ['B01001_{:03d}E'.format(i) for i in range(1, 121)]
+
+    def census(self, session, **kwargs):
+        return Census('fake-key', session=session, **kwargs)
+
+    def test_get_chunks_concurrently(self):
+        session = FakeSession(delay=0.05)
+        results = self.census(session).acs5.get(self.fields, {'for': 'state:*'})
+
+        data_calls = [params for _, params in session.calls if 'get' in params]
+        self.assertEqual(len(data_calls), 3)
+        self.assertGreater(session.max_in_flight, 1)
+
+        self.assertEqual(len(results), len(FakeSession.states))
+        for row in results:
+            self.assertEqual(row['GEO_ID'][-2:], row['state'])
+            self.assertTrue(set(row).issuperset(self.fields))
+
+    def test_get_chunks_serially(self):
+        session = FakeSession()
+        self.census(session, max_workers=1).acs5.get(self.fields, {'for': 'state:*'})
+        self.assertEqual(session.max_in_flight, 1)
+
+    def test_field_types_from_one_document(self):
+        session = FakeSession(variables=dict.fromkeys(self.fields, 'int'))
+        census = self.census(session)
+        results = census.acs5.get(self.fields, {'for': 'state:*'})
+        census.acs.get(self.fields, {'for': 'state:*'})
+
+        metadata_calls = [url for url, params in session.calls if 'get' not in params]
+        self.assertEqual(metadata_calls,
+                         ['https://api.census.gov/data/2024/acs/acs5/variables.json'])
+        self.assertEqual(results[0][self.fields[0]], 1.11)
+        self.assertEqual(results[0]['state'], '01')
+
+    def test_failed_type_load_is_not_repeated(self):
+        class NoVariables(FakeSession):
+            def respond(self, url, params):
+                if url.endswith('/variables.json'):
+                    return FakeResponse(503, 'unavailable')
+                return super(NoVariables, self).respond(url, params)
+
+        session = NoVariables()
+        acs5 = self.census(session).acs5
+        for _ in range(2):
+            rows = acs5.get(self.fields[:40], {'for': 'state:*'})
+        self.assertEqual(rows[0][self.fields[0]], '{}.11'.format(int(rows[0]['state'])))
+        urls = [url for url, _ in session.calls]
+        self.assertEqual(sum(url.endswith('/variables.json') for url in urls), 1)
+        self.assertEqual(len(urls), 3)
+
+    def test_prefetch(self):
+        session = FakeSession()
+        census = self.census(session)
+        census.prefetch(['acs5', 'pl'], [2020, 2010])
+        self.assertEqual(len(session.calls), 4)
+
+        census.pl.get('NAME', {'for': 'state:*'}, year=2010)
+        self.assertEqual(len(session.calls), 5)
+
+        with self.assertRaises(UnsupportedYearException):
+            census.prefetch('pl', 2015)
+
+        census.prefetch('acs5', range(2017, 2020))
+        census.acs1.prefetch(year for year in (2018, 2019))
+        self.assertEqual(len(session.calls), 10)
+
+    def test_endpoints_resolved_per_call(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        session = FakeSession()
+        acs1 = self.census(session).acs1
+        years = [2004, 2020] * 20
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda year: acs1.get('NAME', {'for': 'state:*'}, year=year), years))
+
+        for url, params in session.calls:
+            if url.startswith('https://api.census.gov/data/2004/'):
+                self.assertFalse(url.startswith('https://api.census.gov/data/2004/acs/'), url)
+            else:
+                self.assertTrue(url.startswith('https://api.census.gov/data/2020/acs/acs1'), url)
+        self.assertNotIn('endpoint_url', vars(acs1))
+
+    def test_fan_out(self):
+        session = FakeSession()
+        acs5 = self.census(session).acs5
+        results = acs5.fan_out(self.fields, {'for': 'block group:*', 'in': 'state:* county:* tract:000100'})
+
+        geographies = FakeSession.geographies
+        self.assertEqual(len(results), len(geographies['state']) * len(geographies['county']) * 2)
+        # Parents come in order, and each parent's rows in the API's order.
+        self.assertEqual(
+            sorted((row['state'], row['county'], row['tract'], row['block group'])
+                   for row in results[:2]),
+            [('01', '001', '000100', '1'), ('01', '001', '000100', '2')])
+        self.assertEqual(
+            sorted((row['state'], row['county'], row['tract'], row['block group'])
+                   for row in results[2:4]),
+            [('01', '003', '000100', '1'), ('01', '003', '000100', '2')])
+        for row in results:
+            self.assertEqual(row['GEO_ID'][9:], ''.join(
+                row[level] for level in ('state', 'county', 'tract', 'block group')))
+
+    def test_columnar_output(self):
+        variables = dict.fromkeys(self.fields, 'int')
+        variables['NAME'] = 'string'
+        census = self.census(FakeSession(variables=variables))
+        fields = ['NAME'] + self.fields
+
+        rows = census.acs5.get(fields, {'for': 'state:*'})
+        columns = census.acs5.get(fields, {'for': 'state:*'}, output='columns')
+
+        self.assertEqual(set(columns), set(rows[0]))
+        # Each get may come back in a different order.
+        by_state = {row['state']: row for row in rows}
+        for name, column in columns.items():
+            self.assertEqual(list(column), [by_state[state][name] for state in columns['state']])
+        self.assertEqual(columns[self.fields[0]].typecode, 'd')
+        self.assertEqual(sorted(columns['state']), list(FakeSession.states))
+
+        tracts = census.acs5.fan_out(['NAME'], {'for': 'tract:*', 'in': 'state:* county:001'},
+                                     output='columns')
+        self.assertEqual(len(tracts['tract']), len(FakeSession.states) * 2)
+
+    def test_records_output(self):
+        import pickle
+
+        census = self.census(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        rows = census.acs5.get(self.fields, {'for': 'state:*'})
+        records = census.acs5.get(self.fields, {'for': 'state:*'}, output='records')
+
+        self.assertEqual(records, rows)
+        record = records[0]
+        self.assertEqual(dict(record), rows[0])
+        self.assertEqual(record[self.fields[0]], rows[0][self.fields[0]])
+        self.assertEqual(list(record), list(rows[0]))
+        self.assertIn('state', record)
+        self.assertIsNone(record.get('B99999_001E'))
+        self.assertIs(records[1]._index, record._index)
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        with self.assertRaises(AttributeError):
+            record.extra = 1
+
+        tracts = census.acs5.fan_out(['NAME'], {'for': 'tract:*', 'in': 'state:* county:001'},
+                                     output='records')
+        self.assertEqual(len(tracts), len(FakeSession.states) * 2)
+
+    def test_numpy_output(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('NumPy is not installed')
+
+        census = self.census(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        rows = census.acs5.get(self.fields, {'for': 'state:*'})
+        result = census.acs5.get(self.fields, {'for': 'state:*'}, output='numpy')
+
+        self.assertEqual(result.dtype[self.fields[0]], numpy.float64)
+        by_state = {row['state']: row for row in rows}
+        self.assertEqual(sorted(result['state']), sorted(by_state))
+        self.assertEqual(list(result[self.fields[-1]]),
+                         [by_state[state][self.fields[-1]] for state in result['state']])
+
+    def test_row_decoder(self):
+        headers = ('A', 'B', 'NAME')
+        types = (float_or_str, float, str)
+        data = [['1', '-666666666', 'x'], [None, '2.5', None], ['(X)', '3', 'y']]
+
+        rows = compile_decoder(headers, types).dicts(data)
+        self.assertEqual([row['A'] for row in rows], [1.0, None, '(X)'])
+        self.assertEqual([row['B'] for row in rows], [-666666666.0, 2.5, 3.0])
+
+        decoder = compile_decoder(headers, types, ACS_ANNOTATIONS)
+        self.assertIs(decoder, compile_decoder(headers, types, ACS_ANNOTATIONS))
+        rows = decoder.dicts(data)
+        self.assertEqual(rows, [decoder.row(d) for d in data])
+        self.assertEqual([row['B'] for row in rows], [None, 2.5, 3.0])
+        self.assertEqual([row['NAME'] for row in rows], ['x', None, 'y'])
+
+        columns = decode_columns(headers, types, data, sentinels=ACS_ANNOTATIONS)
+        self.assertEqual(columns['A'], [1.0, None, '(X)'])
+        self.assertEqual(columns['B'].typecode, 'd')
+        self.assertNotEqual(columns['B'][0], columns['B'][0])
+        self.assertEqual(list(columns['B'])[1:], [2.5, 3.0])
+
+    def test_null_values(self):
+        session = FakeSession(variables=dict.fromkeys(self.fields, 'int'))
+        census = self.census(session, null_values=[float(FakeSession.value(self.fields[0], '01'))])
+        rows = census.acs5.get(self.fields[:5], {'for': 'state:*'})
+        by_state = {row['state']: row for row in rows}
+        self.assertIsNone(by_state['01'][self.fields[0]])
+        self.assertEqual(by_state['02'][self.fields[0]], 2.11)
+
+    def test_iter_query(self):
+        census = self.census(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        geo = {'for': 'county:*', 'in': 'state:06'}
+        rows = census.acs5.get(self.fields[:20], geo)
+        streamed = census.acs5.iter_query(self.fields[:20], geo, chunk_size=7)
+        self.assertEqual(sorted(streamed, key=lambda row: row['county']),
+                         sorted(rows, key=lambda row: row['county']))
+
+    def test_iter_get(self):
+        census = self.census(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        rows = census.acs5.get(self.fields, {'for': 'state:*'})
+        streamed = census.acs5.iter_get(self.fields, {'for': 'state:*'})
+        key = itemgetter('state')
+        self.assertEqual(sorted(streamed, key=key),
+                         [{k: v for k, v in row.items() if k != 'GEO_ID'}
+                          for row in sorted(rows, key=key)])
+
+    def test_iter_get_unmatched_rows(self):
+        fields = self.fields
+
+        class Gaps(FakeSession):
+
+            def respond(self, url, params):
+                resp = super(Gaps, self).respond(url, params)
+                # The first chunk has no '01' and the last has no '06'.
+                if fields[0] in params.get('get', ''):
+                    missing = '01'
+                elif fields[-1] in params.get('get', ''):
+                    missing = '06'
+                else:
+                    return resp
+                return FakeResponse(200, [row for row in resp.json() if row[-1] != missing])
+
+        census = self.census(Gaps(variables=dict.fromkeys(fields, 'int')))
+        with self.assertWarns(UnmatchedRowsWarning):
+            streamed = list(census.acs5.iter_get(fields, {'for': 'state:*'}))
+
+        rows = {row['state']: row for row in streamed}
+        self.assertEqual(len(streamed), len(FakeSession.states))
+        for row in streamed:
+            self.assertEqual(list(row)[48:50], [fields[48], 'state'])
+            self.assertEqual(set(row), set(fields) | {'state'})
+        self.assertIsNone(rows['01'][fields[0]])
+        self.assertEqual(rows['01'][fields[-1]], 1.11)
+        self.assertIsNone(rows['06'][fields[-1]])
+        self.assertEqual(rows['06'][fields[0]], 6.11)
+        self.assertEqual(rows['02'][fields[0]], 2.11)
+        self.assertEqual(streamed[-1]['state'], '06')
+
+    def test_iter_json_array(self):
+        text = '[["NAME","state"],\n["Caña, \\"CA\\"","06"], [null, "01"]]'
+        for size in (1, 3, len(text)):
+            chunks = (text[i:i + size] for i in range(0, len(text), size))
+            self.assertEqual(list(iter_json_array(chunks)),
+                             [['NAME', 'state'], ['Caña, "CA"', '06'], [None, '01']])
+
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['[["NAME"], ["x"']))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['<html><title>Invalid Key</title></html>']))
+
+    def test_join_on_geography_columns(self):
+        session = FakeSession()
+        results = self.census(session).acs5.get(
+            self.fields, {'for': 'county:*', 'in': 'state:06'}, year=2009)
+
+        data_calls = [params for _, params in session.calls if 'get' in params]
+        self.assertTrue(all('GEO_ID' not in params['get'] for params in data_calls))
+        self.assertEqual(len(results), len(FakeSession.geographies['county']))
+        for row in results:
+            geoid = row['state'] + row['county']
+            for field in self.fields:
+                self.assertEqual(row[field], FakeSession.value(field, geoid))
+
+    def test_join_reports_unmatched_rows(self):
+        tables = [
+            (['A', 'state'], [['1', '01'], ['2', '02']]),
+            (['B', 'state'], [['3', '02'], ['4', '04']]),
+        ]
+        with self.assertWarns(UnmatchedRowsWarning):
+            headers, rows = join_tables(tables, [['A'], ['B']])
+
+        self.assertEqual(headers, ['A', 'state', 'B'])
+        self.assertEqual(rows, [['1', '01', None], ['2', '02', '3'], [None, '04', '4']])
+
+    def test_get_with_empty_chunks(self):
+        class NoContent(FakeSession):
+            empty = None
+
+            def respond(self, url, params):
+                if 'get' in params and (self.empty is None or self.empty in params['get']):
+                    return FakeResponse(204, '')
+                return super(NoContent, self).respond(url, params)
+
+        session = NoContent()
+        self.assertEqual(self.census(session).acs5.get(self.fields, {'for': 'state:*'}), [])
+
+        session = NoContent()
+        session.empty = self.fields[-1]
+        with self.assertWarns(UnmatchedRowsWarning):
+            rows = self.census(session).acs5.get(self.fields, {'for': 'state:*'})
+        self.assertEqual(len(rows), len(FakeSession.states))
+        self.assertEqual(set(rows[0]), set(self.fields) | {'GEO_ID', 'state'})
+        self.assertIsNone(rows[0][self.fields[-1]])
+        self.assertIsNotNone(rows[0][self.fields[0]])
+
+    def test_request_events(self):
+        census = self.census(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        events = []
+        census.hooks.subscribe(events.append)
+
+        census.acs5.get(self.fields, {'for': 'county:*', 'in': 'state:06'})
+        self.assertEqual(sorted(event.kind for event in events), ['chunk', 'chunk', 'chunk', 'get'])
+        get_event = events[-1]
+        self.assertEqual((get_event.dataset, get_event.year, get_event.geo_level),
+                         ('acs5', 2024, 'county'))
+        self.assertEqual((get_event.fields, get_event.rows), (120, 2))
+        self.assertEqual(set(get_event.phases), {'fetch', 'join', 'types', 'cast'})
+        for event in events[:-1]:
+            self.assertEqual(event.status, 200)
+            self.assertGreater(event.bytes, 0)
+            self.assertEqual(event.retries, 0)
+            self.assertIsNone(event.cache)
+            self.assertTrue(event.url.startswith('https://api.census.gov/data/2024/acs/acs5'))
+            self.assertEqual(set(event.phases), {'network', 'json'})
+
+        del events[:]
+        census.acs5.state('NAME', '06')
+        event, = events
+        self.assertEqual((event.kind, event.fields, event.rows), ('query', 1, 1))
+        self.assertEqual(set(event.phases), {'network', 'json', 'types', 'cast'})
+
+        census.hooks.unsubscribe(events.append)
+        census.acs5.state('NAME', '06')
+        self.assertEqual(len(events), 1)
+
+    def test_failing_hook_warns(self):
+        census = self.census(FakeSession(fail_on='B99999_001E'))
+
+        @census.hooks.subscribe
+        def broken(event):
+            raise KeyError(event.kind)
+
+        with self.assertWarns(RuntimeWarning):
+            census.acs5.state('NAME', '06')
+
+        events = []
+        census.hooks.subscribe(events.append)
+        with self.assertRaises(CensusException), self.assertWarns(RuntimeWarning):
+            census.acs5.state('B99999_001E', '06')
+        self.assertIsInstance(events[0].error, CensusException)
+        self.assertEqual(events[0].status, 400)
+
+    def test_panel(self):
+        session = FakeSession(delay=0.05, variables={'NAME': 'string'})
+        acs5 = self.census(session).acs5
+        years = range(2015, 2023)
+        start = time.time()
+        rows = acs5.panel('NAME', {'for': 'state:01,02'}, years)
+        self.assertLess(time.time() - start, 0.05 * len(years))
+
+        self.assertEqual([row['year'] for row in rows], [year for year in years for _ in range(2)])
+        self.assertEqual(sorted(rows[:2], key=itemgetter('state')),
+                         [{'NAME': '1.4', 'state': '01', 'year': 2015},
+                          {'NAME': '2.4', 'state': '02', 'year': 2015}])
+        data_urls = sorted(url for url, params in session.calls if 'get' in params)
+        self.assertEqual(data_urls, ['https://api.census.gov/data/{}/acs/acs5'.format(year)
+                                     for year in years])
+
+        records = acs5.panel('NAME', {'for': 'state:01'}, [2020, 2021], output='records')
+        self.assertEqual(records, [{'NAME': '1.4', 'state': '01', 'year': 2020},
+                                   {'NAME': '1.4', 'state': '01', 'year': 2021}])
+        columns = acs5.panel('NAME', {'for': 'state:01'}, [2020, 2021], output='columns')
+        self.assertEqual(list(columns['year']), [2020, 2021])
+        self.assertEqual(columns['NAME'], ['1.4', '1.4'])
+
+        calls = len(session.calls)
+        with self.assertRaises(UnsupportedYearException) as cm:
+            acs5.panel('NAME', {'for': 'state:*'}, range(2000, 2012))
+        self.assertIn('2000, 2001', str(cm.exception))
+        self.assertEqual(len(session.calls), calls)
+
+    def test_batch(self):
+        session = FakeSession(variables={'NAME': 'string'})
+        acs5 = self.census(session).acs5
+        geos = ([{'for': 'county:{:03d}'.format(i), 'in': 'state:06'} for i in range(1, 301)]
+                + [{'for': 'county:001', 'in': 'state:24'},
+                   {'for': 'county:001', 'in': ' state:06'},
+                   {'for': 'state:02'}])
+        rows = acs5.batch('NAME', geos, max_url_length=1000)
+
+        data_calls = [params for _, params in session.calls if 'get' in params]
+        self.assertEqual(len(data_calls), 4)
+        self.assertEqual(sorted(len(params['for']) for params in data_calls)[:2],
+                         [len('state:02'), len('county:001')])
+        for params in data_calls:
+            url = requests.Request('GET', 'https://api.census.gov/data/2024/acs/acs5',
+                                   params=params).prepare().url
+            self.assertLessEqual(len(url), 1000)
+
+        self.assertEqual(len(rows), len(geos))
+        for geo, row in zip(geos, rows):
+            code = geo['for'].split(':')[1]
+            self.assertEqual(row['NAME'], FakeSession.value(
+                'NAME', ''.join(code for _, code in re.findall(r'(\S+):(\S+)', geo.get('in', ''))) + code))
+        self.assertEqual(rows[-2], rows[0])
+
+        class MissingCounty(FakeSession):
+            def respond(self, url, params):
+                resp = super(MissingCounty, self).respond(url, params)
+                if 'get' in params:
+                    resp = FakeResponse(200, [row for row in resp.json() if row[-1] != '999'])
+                return resp
+
+        acs5 = self.census(MissingCounty()).acs5
+        rows = acs5.batch('NAME', [{'for': 'county:999', 'in': 'state:06'},
+                                   {'for': 'county:001', 'in': 'state:06'}])
+        self.assertEqual(rows, [None, {'NAME': '6001.4', 'state': '06', 'county': '001'}])
+        with self.assertRaises(ValueError):
+            acs5.batch('NAME', [{'for': 'county:*', 'in': 'state:06'}])
+
+    def test_lazy_clients(self):
+        census = self.census(FakeSession())
+        self.assertFalse(set(vars(census)) & set(Census.DATASETS))
+
+        acs5 = census.acs5
+        self.assertIs(census.acs5, acs5)
+        self.assertEqual(set(vars(census)) & set(Census.DATASETS), {'acs5'})
+        self.assertIs(census.pl.field_types, acs5.field_types)
+        with self.assertRaises(AttributeError):
+            census.acs2
+
+    def test_set_session(self):
+        census = self.census(FakeSession())
+        acs5 = census.acs5
+        session = FakeSession()
+        census.session = session
+
+        self.assertIs(census.session, session)
+        self.assertIs(acs5.session, session)
+        self.assertIs(census.pl.session, session)
+        self.assertIn('User-Agent', session.headers)
+        census.acs5.state('NAME', '06')
+        self.assertEqual(len(session.calls), 2)
+
+    def test_import_is_light(self):
+        import subprocess
+        import sys
+
+        loaded = subprocess.check_output([sys.executable, '-c', (
+            'import sys, census; census.Census("key"); '
+            'print(" ".join(m for m in ("requests", "asyncio", "concurrent.futures", "inspect", '
+            '"importlib.metadata") if m in sys.modules))')], universal_newlines=True)
+        self.assertEqual(loaded.split(), [])
+
+    def test_single_flight(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        session = FakeSession(delay=0.1, variables={'NAME': 'string'})
+        census = self.census(session)
+        events = []
+        census.hooks.subscribe(events.append)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: census.acs5.state('NAME', '06'), range(8)))
+
+        data_calls = [params for _, params in session.calls if 'get' in params]
+        metadata_calls = [params for _, params in session.calls if 'get' not in params]
+        self.assertEqual((len(data_calls), len(metadata_calls)), (1, 1))
+        self.assertEqual(results, [[{'NAME': '6.4', 'state': '06'}]] * 8)
+        self.assertEqual(sorted(event.coalesced for event in events), [False] + [True] * 7)
+        self.assertIsNot(results[0], results[1])
+
+        census.acs5.state('NAME', '06')
+        self.assertEqual(len([params for _, params in session.calls if 'get' in params]), 2)
+
+        session = FakeSession(delay=0.1)
+        census = self.census(session, single_flight=False)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: census.acs5.state('NAME', '06'), range(4)))
+        self.assertEqual(len([params for _, params in session.calls if 'get' in params]), 4)
+
+    def test_get_table(self):
+        session = FakeSession()
+        census = self.census(session)
+        events = []
+        census.hooks.subscribe(events.append)
+        rows = census.acs5.get_table('B01001', {'for': 'state:*'}, year=2022)
+
+        self.assertEqual([params['get'] for _, params in session.calls if 'get' in params],
+                         ['group(B01001)'])
+        self.assertEqual([url for url, params in session.calls if 'get' not in params],
+                         ['https://api.census.gov/data/2022/acs/acs5/groups/B01001.json'])
+        self.assertEqual(sorted(rows, key=itemgetter('state'))[0], {
+            'GEO_ID': '0400000US01', 'NAME': '1.4', 'B01001_001E': 1.11,
+            'B01001_001EA': '1.12', 'B01001_001M': 1.11, 'state': '01'})
+        self.assertEqual(len(rows), len(FakeSession.states))
+        self.assertEqual([event.kind for event in events], ['table'])
+
+        columns = census.acs5.get_table('B01001', {'for': 'state:*'}, year=2022,
+                                        output='columns')
+        self.assertEqual(list(columns['B01001_001E']),
+                         [row['B01001_001E'] for row in rows])
+        self.assertEqual(len(session.calls), 3)
+
+        census.acs5.get_table('B01001', {'for': 'state:*'}, 2022)
+        with self.assertRaises(UnsupportedYearException):
+            census.acs5.get_table('B01001', {'for': 'state:*'}, 2001)
+        with self.assertRaises(UnsupportedYearException):
+            census.acs5.fields(2001)
+
+    def test_export(self):
+        import csv
+        import io
+
+        from census.export import export, iter_batches
+
+        census = self.census(FakeSession(variables={'NAME': 'string', 'B01001_001E': 'int'}))
+        geo = {'for': 'county:*', 'in': 'state:*'}
+        batches = list(iter_batches(census.acs5, geo, fields=['NAME', 'B01001_001E'],
+                                    batch_size=1))
+        self.assertEqual(len(batches), 2 * len(FakeSession.states))
+        self.assertEqual(sorted(row['state'] + row['county'] for batch in batches for row in batch),
+                         sorted(row['state'] + row['county']
+                                for row in census.acs5.fan_out('NAME', geo)))
+
+        out = io.StringIO()
+        count = export(census.acs5, out, geo, fields=['NAME', 'B01001_001E'], format='csv')
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual(count, len(rows))
+        self.assertEqual(set(rows[0]), {'NAME', 'B01001_001E', 'state', 'county'})
+
+        census = self.census(FakeSession(variables=dict.fromkeys(self.fields, 'int')))
+        for geo in ({'for': 'county:*', 'in': 'state:*'}, {'for': 'county:*', 'in': 'state:06'}):
+            rows = [row for batch in iter_batches(census.acs5, geo, fields=self.fields)
+                    for row in batch]
+            self.assertEqual(list(rows[0]), self.fields[:49] + ['state', 'county'] + self.fields[49:])
+
+        out = io.StringIO()
+        count = export(census.acs5, out, {'for': 'state:*'}, table='B01001', format='ndjson')
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(count, len(FakeSession.states))
+        self.assertIn('B01001_001M', rows[0])
+
+        with self.assertRaises(ValueError):
+            export(census.acs5, 'rows.xlsx', geo, fields='NAME')
+        with self.assertRaises(ValueError):
+            export(census.acs5, out, geo, format='csv')
+
+    def test_export_parquet(self):
+        import tempfile
+
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+
+        from census.export import export
+
+        class Annotated(FakeSession):
+
+            def value(self, field, geoid):
+                # Every annotation is null, and one estimate is not a number.
+                if field.endswith('EA'):
+                    return None
+                if field == 'B01001_001E' and geoid == '06':
+                    return 'N'
+                return super(Annotated, self).value(field, geoid)
+
+        census = self.census(Annotated())
+        path = os.path.join(tempfile.mkdtemp(), 'rows.parquet')
+        self.addCleanup(os.remove, path)
+        count = export(census.acs5, path, {'for': 'state:*'}, table='B01001', batch_size=2)
+
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(count, len(FakeSession.states))
+        self.assertEqual(str(table.schema.field('B01001_001E').type), 'double')
+        self.assertEqual(str(table.schema.field('B01001_001EA').type), 'string')
+        self.assertEqual(str(table.schema.field('state').type), 'string')
+        self.assertEqual(table.column('B01001_001EA').null_count, count)
+        self.assertEqual(table.column('B01001_001E').null_count, 1)
+
+    def test_resumable_job(self):
+        import tempfile
+
+        import sqlite3
+
+        from census.jobs import CheckpointStore, Job
+
+        variables = dict.fromkeys(self.fields, 'int')
+        geo = {'for': 'county:*', 'in': 'state:*'}
+        with tempfile.TemporaryDirectory() as path:
+            store = os.path.join(path, 'jobs.sqlite')
+
+            failing = FakeSession(variables=variables, fail_on=self.fields[-1])
+            job = Job(self.census(failing, max_workers=1).acs5, self.fields, geo, store=store)
+            with self.assertRaises(CensusException):
+                job.run()
+            self.assertEqual(job.progress(), (2, 3 * len(FakeSession.states)))
+            with self.assertRaises(RuntimeError):
+                job.results()
+
+            session = FakeSession(variables=variables)
+            census = self.census(session)
+            job = Job(census.acs5, self.fields, geo, store=store)
+            self.assertEqual(job.run(), 3 * len(FakeSession.states) - 2)
+            self.assertEqual([params for _, params in session.calls if 'NAME' in params['get']], [])
+            self.assertEqual(job.run(), 0)
+            key = itemgetter('GEO_ID')
+            self.assertEqual(sorted(job.results(), key=key),
+                             sorted(census.acs5.fan_out(self.fields, geo), key=key))
+
+            with Job(census.acs5, self.fields[:2], geo, store=store) as other:
+                self.assertEqual(other.progress(), (0, len(FakeSession.states)))
+            with self.assertRaises(sqlite3.ProgrammingError):
+                other.progress()
+
+            shared = CheckpointStore(store)
+            with Job(census.acs5, self.fields, geo, store=shared) as job:
+                self.assertEqual(job.progress(), (3 * len(FakeSession.states),) * 2)
+            self.assertEqual(shared.units(job.id), job.units())
+            shared.close()
+
+    def test_default_job_store(self):
+        import tempfile
+
+        from census.jobs import Job
+
+        with tempfile.TemporaryDirectory() as path:
+            os.environ['XDG_CACHE_HOME'] = path
+            try:
+                with Job(self.census(FakeSession()).acs5, 'NAME', {'for': 'state:*'}) as job:
+                    self.assertEqual(job.store.path,
+                                     os.path.join(path, 'python-census', 'jobs.sqlite'))
+            finally:
+                del os.environ['XDG_CACHE_HOME']
+
+    def test_resumable_job_with_empty_chunks(self):
+        import tempfile
+
+        from census.jobs import Job
+
+        fields = self.fields
+
+        class NoContent(FakeSession):
+
+            def respond(self, url, params):
+                if fields[-1] in params.get('get', ''):
+                    return FakeResponse(204, '')
+                return super(NoContent, self).respond(url, params)
+
+        census = self.census(NoContent(variables=dict.fromkeys(fields, 'int')))
+        geo = {'for': 'county:*', 'in': 'state:06'}
+        with tempfile.TemporaryDirectory() as path:
+            job = Job(census.acs5, fields, geo, store=os.path.join(path, 'jobs.sqlite'))
+            job.run()
+            with self.assertWarns(UnmatchedRowsWarning):
+                rows = job.results()
+            with self.assertWarns(UnmatchedRowsWarning):
+                key = itemgetter('county')
+                self.assertEqual(sorted(rows, key=key),
+                                 sorted(census.acs5.get(fields, geo), key=key))
+            self.assertEqual(len(rows[0]), len(fields) + 3)
+
+    def test_record_and_replay(self):
+        import gzip
+        import tempfile
+
+        from census.archive import ArchiveMissError, RecordingTransport, ReplayTransport
+
+        def pipeline(census):
+            return (census.acs5.get(self.fields, {'for': 'state:*'}),
+                    list(census.acs5.iter_query('NAME', {'for': 'state:06'})),
+                    census.acs5.get_table('B01001', {'for': 'state:01'}),
+                    census.acs5.tables())
+
+        with tempfile.TemporaryDirectory() as path:
+            archive = os.path.join(path, 'run.jsonl.gz')
+            session = FakeSession(variables=dict.fromkeys(self.fields, 'int'))
+            with self.census(RecordingTransport(archive, session)) as census:
+                recorded = pipeline(census)
+
+            with gzip.open(archive, 'rt') as f:
+                self.assertNotIn('fake-key', f.read())
+
+            replay = ReplayTransport(archive)
+            self.assertEqual(pipeline(Census('other-key', session=replay)), recorded)
+            self.assertEqual(replay.hits, len(session.calls))
+            with self.assertRaises(ArchiveMissError):
+                Census('other-key', session=replay).acs5.state('NAME', '24')
+
+    def test_transports(self):
+        from census.transport import HTTPXTransport, RequestsTransport
+
+        census = Census('key', max_workers=32, timeout=5)
+        self.assertIsInstance(census.session, RequestsTransport)
+        adapter = census.session.get_adapter('https://api.census.gov/data')
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertEqual(census.session.timeout, 5)
+        self.assertIs(census.acs5.session, census.pl.session)
+        with self.assertRaises(ValueError):
+            Census('key', transport='spdy')
+
+        try:
+            import httpx
+        except ImportError:
+            self.skipTest('httpx is not installed')
+
+        fake = FakeSession(variables={'NAME': 'string'})
+
+        def handler(request):
+            resp = fake.respond(str(request.url.copy_with(query=None)),
+                                dict(request.url.params))
+            return httpx.Response(resp.status_code, content=resp.content,
+                                  headers=resp.headers)
+
+        session = HTTPXTransport(pool_size=4, compression=False,
+                                 transport=httpx.MockTransport(handler))
+        with self.census(session) as census:
+            self.assertEqual(census.acs5.state('NAME', '06'), [{'NAME': '6.4', 'state': '06'}])
+            self.assertEqual(list(census.acs5.iter_query('NAME', {'for': 'state:06'})),
+                             [{'NAME': '6.4', 'state': '06'}])
+            self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+
+    def test_chunk_error_surfaces(self):
+        session = FakeSession(fail_on=self.fields[-1])
+        with self.assertRaises(CensusException):
+            self.census(session).acs5.get(self.fields, {'for': 'state:*'})
+
+
+class FlakySession(FakeSession):
+    """
+    Fails the first data requests with the given responses or errors.
+    """
+
+    def __init__(self, failures, **kwargs):
+        super(FlakySession, self).__init__(**kwargs)
+        self.failures = list(failures)
+
+    def respond(self, url, params):
+        if 'get' in params and self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        return super(FlakySession, self).respond(url, params)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def query(self, failures, policy):
+        session = FlakySession(failures)
+        census = Census('fake-key', session=session, retry_policy=policy)
+        return census.acs5.state('NAME', '*')
+
+    def test_events_count_retries(self):
+        session = FlakySession([FakeResponse(502, 'Bad Gateway')])
+        census = Census('fake-key', session=session,
+                        retry_policy=RetryPolicy(max_attempts=2, backoff=0.001))
+        events = []
+        census.hooks.subscribe(events.append)
+        census.acs5.state('NAME', '*')
+
+        event, = events
+        self.assertEqual((event.retries, event.status), (1, 200))
+        self.assertIsNone(event.error)
+
+    def test_retries_statuses_and_connection_errors(self):
+        policy = RetryPolicy(max_attempts=4, backoff=0.001)
+        self.query([FakeResponse(502, 'Bad Gateway'),
+                    ConnectionResetError('reset'),
+                    FakeResponse(500, 'There was an error while running your query.  '
+                                      "We've logged the error and we'll correct it ASAP.  "
+                                      'Sorry for the inconvenience.')],
+                   policy)
+        self.assertEqual(policy.retries, 3)
+        self.assertEqual(policy.reasons, {502: 1, 'ConnectionResetError': 1, 500: 1})
+
+    def test_gives_up(self):
+        policy = RetryPolicy(max_attempts=2, backoff=0.001)
+        with self.assertRaises(CensusException) as cm:
+            self.query([FakeResponse(503, 'Unavailable')] * 2, policy)
+        self.assertEqual(cm.exception.status_code, 503)
+
+        with self.assertRaises(CensusException):
+            self.query([FakeResponse(400, 'error: unknown variable')], policy)
+        self.assertEqual(policy.retries, 1)
+
+    def test_per_status_rules_and_budget(self):
+        policy = RetryPolicy(statuses={503: 5}, backoff=0.001, budget=5)
+        self.query([FakeResponse(503, 'Unavailable')] * 4, policy)
+        with self.assertRaises(CensusException):
+            self.query([FakeResponse(503, 'Unavailable')] * 4, policy)
+        self.assertEqual(policy.retries, 5)
+
+    def test_setting_retries_leaves_shared_policy_alone(self):
+        policy = RetryPolicy(max_attempts=4, backoff=0.001)
+        census = Census('fake-key', session=FakeSession(), retry_policy=policy)
+        census.acs5.retries = 1
+
+        self.assertEqual(census.acs5.retries, 1)
+        self.assertEqual(census.sf1.retries, 4)
+        self.assertEqual(policy.max_attempts, 4)
+        self.assertIs(census.pl.retry_policy, policy)
+        self.assertEqual(census.acs5.retry_policy.backoff, 0.001)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(jitter=False)
+        throttled = FakeResponse(429, 'Too Many Requests', {'Retry-After': '0.05'})
+        start = time.monotonic()
+        self.query([throttled], policy)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(policy.sleep_time, 0.05)
+
+
 class TestAPIKeyRequired(unittest.TestCase):
 
     def test_census_raises_without_key(self):
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from census.core import Census
+from census.tests.test_census import FakeResponse, FakeSession
+from census.throttle import AsyncRateLimiter, RateLimiter
+
+
+class ThrottlingSession(FakeSession):
+    """
+    Answers 429 whenever more than `capacity` requests are in flight.
+    """
+
+    def __init__(self, capacity, **kwargs):
+        super(ThrottlingSession, self).__init__(**kwargs)
+        self.capacity = capacity
+        self.throttled = 0
+
+    def respond(self, url, params):
+        if self.in_flight > self.capacity:
+            with self._lock:
+                self.throttled += 1
+            return FakeResponse(429, 'Too Many Requests')
+        return super(ThrottlingSession, self).respond(url, params)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=50, burst=1)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+            limiter.release(200)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_async_token_bucket(self):
+        limiter = AsyncRateLimiter(rate=50, burst=1)
+
+        async def main():
+            for _ in range(6):
+                await limiter.acquire()
+                await limiter.release(200)
+
+        start = time.monotonic()
+        asyncio.run(main())
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_aimd(self):
+        limiter = RateLimiter(max_concurrency=8, initial_concurrency=4, backoff_interval=0)
+        limiter.acquire()
+        limiter.release(429)
+        self.assertEqual(limiter.concurrency, 2)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(200)
+        self.assertGreater(limiter.concurrency, 4)
+        self.assertLessEqual(limiter.concurrency, 8)
+
+    def test_shared_by_clients(self):
+        limiter = RateLimiter(max_concurrency=3, initial_concurrency=3)
+        session = ThrottlingSession(capacity=3, delay=0.01)
+        census = Census('fake-key', session=session, rate_limiter=limiter)
+
+        threads = [threading.Thread(target=client.state, args=('NAME', '*'))
+                   for client in (census.acs5, census.acs1, census.pl) * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(session.max_in_flight, 3)
+        self.assertEqual(session.throttled, 0)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_throttled_requests_are_retried(self):
+        limiter = RateLimiter(max_concurrency=4, initial_concurrency=4)
+        session = ThrottlingSession(capacity=2, delay=0.01)
+        census = Census('fake-key', session=session, rate_limiter=limiter, max_workers=4)
+
+        census.acs5.get(['B01001_{:03d}E'.format(i) for i in range(1, 120)], {'for': 'state:*'})
+        self.assertGreater(session.throttled, 0)
+        self.assertLess(limiter.concurrency, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+    Client-side request budget shared by every dataset client of a
+    Census object.
+
+    A token bucket caps the request rate at rate requests per second,
+    allowing bursts of up to burst requests. On top of it, an AIMD
+    controller sets how many requests may be in flight: each successful
+    response raises the limit by about one per round of requests, and a
+    throttling response (429 or 503 by default) cuts it by decrease, at
+    most once per backoff_interval seconds, and empties the bucket.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=32,
+                 min_concurrency=1, initial_concurrency=None, decrease=0.5,
+                 backoff_interval=1.0, throttle_statuses=(429, 503)):
+        self.rate = rate
+        self.burst = burst or max(1, rate or 1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = initial_concurrency or max(min_concurrency, max_concurrency // 2)
+        self.decrease = decrease
+        self.backoff_interval = backoff_interval
+        self.throttle_statuses = throttle_statuses
+
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self._slots = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        with self._slots:
+            while self.in_flight >= int(self.concurrency):
+                self._slots.wait()
+            self.in_flight += 1
+        try:
+            self._take_token()
+        except BaseException:
+            self.release()
+            raise
+
+    def _take_token(self):
+        while True:
+            wait = self._token_wait()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _token_wait(self):
+        """
+        Take a token and return 0, or return how many seconds to wait
+        before one is available.
+        """
+        if self.rate is None:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def release(self, status_code=None):
+        """
+        Return the slot taken by acquire, adjusting the concurrency limit
+        by the response's status_code. Pass None when the request failed
+        without a response.
+        """
+        with self._slots:
+            self._finish(status_code)
+            self._slots.notify_all()
+
+    def _finish(self, status_code):
+        self.in_flight -= 1
+        if status_code in self.throttle_statuses:
+            self._back_off()
+        elif status_code is not None and status_code < 400:
+            self.concurrency = min(self.max_concurrency,
+                                   self.concurrency + 1.0 / self.concurrency)
+
+    def _back_off(self):
+        self.throttled += 1
+        now = time.monotonic()
+        if self._last_decrease is not None and now - self._last_decrease < self.backoff_interval:
+            return
+        self._last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease)
+        with self._lock:
+            self._tokens = 0
+            self._updated = now
+
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    A RateLimiter for the clients of an AsyncCensus, whose acquire and
+    release are coroutines that wait without blocking the event loop.
+    Use each one from a single event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncRateLimiter, self).__init__(*args, **kwargs)
+        self._async_slots = None
+
+    @property
+    def _waiting(self):
+        # Created on first use so that it belongs to the running loop.
+        if self._async_slots is None:
+            import asyncio
+            self._async_slots = asyncio.Condition()
+        return self._async_slots
+
+    async def acquire(self):
+        """
+        Wait until a request may be sent.
+        """
+        import asyncio
+
+        slots = self._waiting
+        async with slots:
+            await slots.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        try:
+            while True:
+                wait = self._token_wait()
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self, status_code=None):
+        """
+        See RateLimiter.release.
+        """
+        slots = self._waiting
+        async with slots:
+            self._finish(status_code)
+            slots.notify_all()
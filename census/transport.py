@@ -0,0 +1,123 @@
+"""
+Transports send the clients' requests. Both behave like a
+requests.Session as far as the clients are concerned, so either can be
+passed as the session of a Census object or of a single client.
+
+RequestsTransport is a requests.Session with a connection pool sized for
+the client's threads. HTTPXTransport sends requests through httpx, and
+with http2=True multiplexes them over a few HTTP/2 connections; it needs
+httpx, and h2 for HTTP/2 (``pip install census[http2]``).
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def new_transport(name='requests', pool_size=10, timeout=None, keep_alive=True,
+                  compression=True):
+    """
+    Create the transport called name: 'requests', 'httpx' or 'http2'.
+    """
+    if name == 'requests':
+        return RequestsTransport(pool_size, timeout, keep_alive, compression)
+    if name in ('httpx', 'http2'):
+        return HTTPXTransport(pool_size, timeout, keep_alive, compression,
+                              http2=name == 'http2')
+    raise ValueError('transport must be one of requests, httpx, http2')
+
+
+def _transport_headers(keep_alive, compression):
+    headers = {}
+    if not keep_alive:
+        headers['Connection'] = 'close'
+    if not compression:
+        headers['Accept-Encoding'] = 'identity'
+    return headers
+
+
+class RequestsTransport(requests.Session):
+    """
+    A requests.Session keeping up to pool_size connections to each host
+    open. Requests beyond that open extra connections, which are closed
+    once they are done, unless pool_block is set, in which case they wait
+    for a pooled connection instead. timeout (seconds, or a (connect,
+    read) tuple) applies to requests that don't set their own.
+    """
+
+    def __init__(self, pool_size=10, timeout=None, keep_alive=True, compression=True,
+                 pool_block=False):
+        super(RequestsTransport, self).__init__()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.headers.update(_transport_headers(keep_alive, compression))
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              pool_block=pool_block)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(RequestsTransport, self).request(method, url, *args, **kwargs)
+
+
+class HTTPXTransport(object):
+    """
+    Sends requests through an httpx.Client, holding at most pool_size
+    connections. With http2=True, requests to the same host share
+    connections instead of waiting for one. Other keyword arguments are
+    passed on to httpx.Client.
+    """
+
+    def __init__(self, pool_size=10, timeout=None, keep_alive=True, compression=True,
+                 http2=False, **kwargs):
+        import httpx
+
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.http2 = http2
+        self.client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size if keep_alive else 0),
+            timeout=timeout,
+            **kwargs)
+        self.client.headers.update(_transport_headers(keep_alive, compression))
+
+    @property
+    def headers(self):
+        return self.client.headers
+
+    def get(self, url, params=None, headers=None, stream=False, timeout=None, **kwargs):
+        request = self.client.build_request(
+            'GET', url, params=params, headers=headers,
+            timeout=self.timeout if timeout is None else timeout)
+        return HTTPXResponse(self.client.send(request, stream=stream))
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HTTPXResponse(object):
+    """
+    An httpx.Response with the parts of the requests.Response interface
+    that the clients use.
+    """
+
+    def __init__(self, response):
+        self._response = response
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_content(self, chunk_size=None):
+        return self._response.iter_bytes(chunk_size)
+
+    def __repr__(self):
+        return repr(self._response)